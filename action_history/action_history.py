@@ -1,36 +1,158 @@
 from models_ import action_history as action_history_db
 from schemas import ActionHistoryCreate
+from database import redis_db, json_dumps, hex_uuids
+from config import config
 
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.util import await_only
 from sqlalchemy.ext.asyncio import AsyncSession
-import json
-from uuid import UUID
+import logging
 from enum import Enum
-from datetime import date, datetime
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+
+ACTION_HISTORY_BUFFER = "action_history_buffer"
+ACTION_HISTORY_STREAM_PENDING = "action_history_stream_pending"
+# Buffer length when each open savepoint began, its entries go when it rolls back
+ACTION_HISTORY_SAVEPOINTS = "action_history_savepoints"
+
+# "buffer" - one multi-row INSERT at commit, "stream" - Redis stream drained by services.action_history_writer,
+# falling back to a direct INSERT after the commit while the stream cannot be written
+ACTION_HISTORY_MODE = config["ActionHistory"]["mode"]
+ACTION_HISTORY_STREAM = "action_history"
+
+# Months read by /history unless cold data is requested
+ACTION_HISTORY_HOT_MONTHS = int(config.get("ActionHistory", "hot_months", 3))
 
 class HistoryActions(Enum):
     create = "create"
     update = "update"
     delete = "delete"
 
-class UUIDEncoder(json.JSONEncoder):
-    def default(self, obj):
-        
-        if isinstance(obj, UUID):
-            return obj.hex
-        
-        if isinstance(obj, (datetime, date)):
-            return obj.isoformat()
-        
-        if isinstance(obj, Enum):
-            return obj.value
-        
-        return super().default(obj)
+def get_month_start(value: datetime) -> datetime:
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def get_hot_boundary() -> datetime:
+    return get_month_start(datetime.utcnow()) - relativedelta(months=ACTION_HISTORY_HOT_MONTHS)
+
+
+def apply_action_to_state(state: dict | None, action: str, detail: dict) -> dict | None:
+    """
+    Fold one history entry into the reconstructed state of its object.
+
+    Updates stored as ActionHistoryDetailUpdate also backfill fields from `old`,
+    so a timeline that starts after the object was created still converges.
+    """
+
+    if action == HistoryActions.create.value:
+        return dict(detail)
+
+    if action == HistoryActions.delete.value:
+        return None
+
+    old = detail.get("old")
+    new = detail.get("new")
+
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return state
+
+    return {**old, **(state or {}), **new}
+
 
 async def add_action_to_history(action: ActionHistoryCreate, session: AsyncSession):
-    action.object_id = str(action.object_id)
+    """
+    Queue an action for the current transaction.
+
+    Entries are written together when the session commits and dropped on rollback.
+    `detail` is encoded once by the engine's json_serializer, with UUIDs as hex (see hex_uuids).
+    """
+
+    payload = action.model_dump()
+    payload["detail"] = hex_uuids(payload["detail"])
+    payload["object_id"] = str(action.object_id)
+    payload["date"] = datetime.utcnow()
+
+    session.sync_session.info.setdefault(ACTION_HISTORY_BUFFER, []).append(payload)
+
+
+async def push_actions_to_stream(entries: list[dict]):
+    # MULTI/EXEC, so a failed push has written nothing and the fallback cannot duplicate entries
+    async with redis_db.pipeline(transaction=True) as pipe:
+        for entry in entries:
+            entry = entry.copy()
+            detail = entry.pop("detail")
+
+            pipe.xadd(
+                ACTION_HISTORY_STREAM,
+                {"payload": json_dumps(entry), "detail": json_dumps(detail)}
+            )
+
+        await pipe.execute()
+
+
+@event.listens_for(Session, "after_transaction_create")
+def _mark_action_history_savepoint(session: Session, transaction):
+    if transaction.nested:
+        buffered = len(session.info.get(ACTION_HISTORY_BUFFER, ()))
+        session.info.setdefault(ACTION_HISTORY_SAVEPOINTS, {})[transaction] = buffered
+
+
+@event.listens_for(Session, "before_commit")
+def _flush_action_history(session: Session):
+    # Releasing a savepoint also commits, its entries wait for the outermost transaction
+    if session.in_nested_transaction():
+        session.info.get(ACTION_HISTORY_SAVEPOINTS, {}).pop(session.get_nested_transaction(), None)
+        return
+
+    session.info.pop(ACTION_HISTORY_SAVEPOINTS, None)
+    entries = session.info.pop(ACTION_HISTORY_BUFFER, None)
+
+    if not entries:
+        return
+
+    if ACTION_HISTORY_MODE == "stream":
+        session.info.setdefault(ACTION_HISTORY_STREAM_PENDING, []).extend(entries)
+        return
+
+    session.execute(action_history_db.insert().values(entries))
+
+
+@event.listens_for(Session, "after_commit")
+def _send_action_history_to_stream(session: Session):
+    if session.in_nested_transaction():
+        return
+
+    entries = session.info.pop(ACTION_HISTORY_STREAM_PENDING, None)
+
+    if not entries:
+        return
+
+    try:
+        await_only(push_actions_to_stream(entries))
+        return
+    except Exception as e:
+        logging.warning(f"Action history stream is unavailable, inserting {len(entries)} entries directly: {e}")
+
+    try:
+        with session.get_bind().begin() as connection:
+            connection.execute(action_history_db.insert().values(entries))
+    except Exception as e:
+        logging.exception(e)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_action_history(session: Session, previous_transaction):
+    # A savepoint only takes back the entries queued since it began
+    if previous_transaction.nested:
+        buffered = session.info.get(ACTION_HISTORY_SAVEPOINTS, {}).pop(previous_transaction, None)
+
+        if buffered is not None:
+            del session.info.get(ACTION_HISTORY_BUFFER, [])[buffered:]
 
-    raw = action.model_dump()
-    payload = json.loads(json.dumps(raw, cls=UUIDEncoder))
+        return
 
-    stmt = action_history_db.insert().values(**payload)
-    await session.execute(stmt)
+    session.info.pop(ACTION_HISTORY_SAVEPOINTS, None)
+    session.info.pop(ACTION_HISTORY_BUFFER, None)
+    session.info.pop(ACTION_HISTORY_STREAM_PENDING, None)
@@ -0,0 +1,114 @@
+"""action_history monthly partitioning
+
+Revision ID: 2133a61dbed7
+Revises: 4eb4f0ead48d
+Create Date: 2026-10-19 12:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2133a61dbed7'
+down_revision: Union[str, None] = '4eb4f0ead48d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = 'id, action, date, subject_uuid, object_table, object_id, detail'
+
+
+def create_indexes() -> None:
+    op.create_index(op.f('ix_action_history_action'), 'action_history', ['action'], unique=False)
+    op.create_index(op.f('ix_action_history_date'), 'action_history', ['date'], unique=False)
+    op.create_index(
+        'ix_action_history_detail',
+        'action_history',
+        ['detail'],
+        unique=False,
+        postgresql_using='gin',
+        postgresql_ops={'detail': 'jsonb_path_ops'}
+    )
+
+
+def drop_indexes() -> None:
+    op.drop_index('ix_action_history_detail', table_name='action_history')
+    op.drop_index(op.f('ix_action_history_date'), table_name='action_history')
+    op.drop_index(op.f('ix_action_history_action'), table_name='action_history')
+
+
+def upgrade() -> None:
+    drop_indexes()
+    op.execute('ALTER TABLE action_history RENAME TO action_history_old')
+    op.execute('ALTER TABLE action_history_old RENAME CONSTRAINT action_history_pkey TO action_history_old_pkey')
+    op.execute('ALTER SEQUENCE action_history_id_seq OWNED BY NONE')
+
+    op.execute("""
+        CREATE TABLE action_history (
+            id INTEGER NOT NULL DEFAULT nextval('action_history_id_seq'),
+            action VARCHAR NOT NULL,
+            date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            subject_uuid UUID NOT NULL REFERENCES "user" (uuid),
+            object_table VARCHAR NOT NULL,
+            object_id VARCHAR NOT NULL,
+            detail JSONB NOT NULL,
+            PRIMARY KEY (id, date)
+        ) PARTITION BY RANGE (date)
+    """)
+    op.execute('ALTER SEQUENCE action_history_id_seq OWNED BY action_history.id')
+
+    # Safety net for rows outside of the monthly partitions, services.action_history_archiver
+    # creates the partitions ahead of time so it stays empty
+    op.execute('CREATE TABLE action_history_default PARTITION OF action_history DEFAULT')
+    op.execute("""
+        DO $$
+        DECLARE
+            month_start timestamp;
+        BEGIN
+            FOR month_start IN
+                SELECT generate_series(
+                    date_trunc('month', COALESCE((SELECT min(date) FROM action_history_old), now())),
+                    date_trunc('month', now()) + interval '2 months',
+                    interval '1 month'
+                )
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF action_history FOR VALUES FROM (%L) TO (%L)',
+                    'action_history_p' || to_char(month_start, 'YYYY_MM'),
+                    month_start,
+                    month_start + interval '1 month'
+                );
+            END LOOP;
+        END $$;
+    """)
+
+    op.execute(f'INSERT INTO action_history ({COLUMNS}) SELECT {COLUMNS} FROM action_history_old')
+    op.execute('DROP TABLE action_history_old')
+    create_indexes()
+
+
+def downgrade() -> None:
+    drop_indexes()
+    op.execute('ALTER TABLE action_history RENAME TO action_history_partitioned')
+    op.execute('ALTER TABLE action_history_partitioned RENAME CONSTRAINT action_history_pkey TO action_history_partitioned_pkey')
+    op.execute('ALTER SEQUENCE action_history_id_seq OWNED BY NONE')
+
+    op.execute("""
+        CREATE TABLE action_history (
+            id INTEGER NOT NULL DEFAULT nextval('action_history_id_seq'),
+            action VARCHAR NOT NULL,
+            date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            subject_uuid UUID NOT NULL REFERENCES "user" (uuid),
+            object_table VARCHAR NOT NULL,
+            object_id VARCHAR NOT NULL,
+            detail JSONB NOT NULL,
+            PRIMARY KEY (id)
+        )
+    """)
+    op.execute('ALTER SEQUENCE action_history_id_seq OWNED BY action_history.id')
+
+    op.execute(f'INSERT INTO action_history ({COLUMNS}) SELECT {COLUMNS} FROM action_history_partitioned')
+    op.execute('DROP TABLE action_history_partitioned')
+    create_indexes()
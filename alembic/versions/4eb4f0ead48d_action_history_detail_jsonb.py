@@ -0,0 +1,50 @@
+"""action_history detail jsonb
+
+Revision ID: 4eb4f0ead48d
+Revises: 2098ad543bd6
+Create Date: 2026-10-19 12:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4eb4f0ead48d'
+down_revision: Union[str, None] = '2098ad543bd6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.alter_column(
+        'action_history',
+        'detail',
+        existing_type=sa.JSON(),
+        type_=postgresql.JSONB(astext_type=sa.Text()),
+        existing_nullable=False,
+        postgresql_using='detail::jsonb'
+    )
+    op.create_index(
+        'ix_action_history_detail',
+        'action_history',
+        ['detail'],
+        unique=False,
+        postgresql_using='gin',
+        postgresql_ops={'detail': 'jsonb_path_ops'}
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_action_history_detail', table_name='action_history', postgresql_using='gin')
+    op.alter_column(
+        'action_history',
+        'detail',
+        existing_type=postgresql.JSONB(astext_type=sa.Text()),
+        type_=sa.JSON(),
+        existing_nullable=False,
+        postgresql_using='detail::json'
+    )
@@ -0,0 +1,81 @@
+"""image registry
+
+Revision ID: 5c0e1d7a9f42
+Revises: eb87fca8d39f
+Create Date: 2026-10-19 14:30:00.000000
+
+"""
+from typing import Sequence, Union
+import os
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+from config import config
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c0e1d7a9f42'
+down_revision: Union[str, None] = 'eb87fca8d39f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Uploads before the registry were stored flat under this directory
+STATIC_IMAGES_DIR = "./static/img"
+LEGACY_FILE_NAME = re.compile(r"^[0-9a-f]{64}\.(?:png|jpeg|gif|webp)$")
+
+
+def upgrade() -> None:
+    op.create_table('image',
+    sa.Column('file_name', sa.String(), nullable=False),
+    sa.Column('hash', sa.String(length=64), nullable=True),
+    sa.Column('size', sa.Integer(), nullable=True),
+    sa.Column('width', sa.Integer(), nullable=True),
+    sa.Column('height', sa.Integer(), nullable=True),
+    sa.Column('mime_type', sa.String(), nullable=True),
+    sa.Column('owner_uuid', sa.UUID(), nullable=True),
+    sa.Column('ref_count', sa.Integer(), server_default='1', nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['owner_uuid'], ['user.uuid'], ),
+    sa.PrimaryKeyConstraint('file_name')
+    )
+    op.create_index(op.f('ix_image_hash'), 'image', ['hash'], unique=False)
+    op.create_index(op.f('ix_image_owner_uuid'), 'image', ['owner_uuid'], unique=False)
+
+    # Images uploaded before the registry: those whose latest history entry is their upload
+    op.execute("""
+        INSERT INTO image (file_name, mime_type, owner_uuid)
+        SELECT object_id, detail->>'content_type', subject_uuid
+        FROM (
+            SELECT DISTINCT ON (object_id) object_id, action, subject_uuid, detail
+            FROM action_history
+            WHERE object_table = 'image'
+            ORDER BY object_id, date DESC
+        ) AS latest
+        WHERE action = 'create'
+    """)
+
+    # Those used by rooms and events, and the files left on disk when the history was archived
+    op.execute("""
+        INSERT INTO image (file_name)
+        SELECT img FROM room WHERE img IS NOT NULL
+        UNION
+        SELECT img FROM event WHERE img IS NOT NULL
+        ON CONFLICT (file_name) DO NOTHING
+    """)
+
+    if config["Storage"]["backend"] != "s3" and os.path.isdir(STATIC_IMAGES_DIR):
+        file_names = [name for name in os.listdir(STATIC_IMAGES_DIR) if LEGACY_FILE_NAME.match(name)]
+
+        if file_names:
+            op.get_bind().execute(
+                sa.text("INSERT INTO image (file_name) VALUES (:file_name) ON CONFLICT (file_name) DO NOTHING"),
+                [{"file_name": file_name} for file_name in file_names]
+            )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_image_owner_uuid'), table_name='image')
+    op.drop_index(op.f('ix_image_hash'), table_name='image')
+    op.drop_table('image')
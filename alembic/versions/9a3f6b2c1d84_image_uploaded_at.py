@@ -0,0 +1,27 @@
+"""image uploaded_at
+
+Revision ID: 9a3f6b2c1d84
+Revises: 5c0e1d7a9f42
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a3f6b2c1d84'
+down_revision: Union[str, None] = '5c0e1d7a9f42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('image', sa.Column('uploaded_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False))
+    op.execute('UPDATE image SET uploaded_at = created_at')
+
+
+def downgrade() -> None:
+    op.drop_column('image', 'uploaded_at')
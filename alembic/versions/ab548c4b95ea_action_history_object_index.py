@@ -0,0 +1,31 @@
+"""action_history object timeline index
+
+Revision ID: ab548c4b95ea
+Revises: 2133a61dbed7
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ab548c4b95ea'
+down_revision: Union[str, None] = '2133a61dbed7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_action_history_object',
+        'action_history',
+        ['object_table', 'object_id', sa.text('date DESC')],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_action_history_object', table_name='action_history')
@@ -13,6 +13,16 @@ from details import *
 from config import config
 from httpx_oauth.clients.microsoft import MicrosoftGraphOAuth2
 from httpx_oauth.oauth2 import RefreshTokenError
+from redis.exceptions import RedisError
+import logging
+from .profile_photo import enqueue_profile_photo
+from .workers_cache import reset_workers_cache
+from .graph import GRAPH_URL, LOGIN_URL
+from .token_refresh import is_refresh_due, schedule_token_refresh, get_refreshed_token
+from .session_store import (
+    SESSION_MODE, is_session_token, create_session, get_session,
+    update_session_tokens, get_session_user, set_session_user
+)
 
 api_key_header = APIKeyHeader(name='Authorization', auto_error=False)
 
@@ -24,6 +34,15 @@ REDIRECT_URI = config['Microsoft']['redirect_url']
 
 microsoft_oauth_client = MicrosoftGraphOAuth2(CLIENT_ID, CLIENT_SECRET, TENANT)
 
+# Follow the configured login URL so a stand-in OAuth server can be used
+microsoft_oauth_client.authorize_endpoint = f"{LOGIN_URL}/{TENANT}/oauth2/v2.0/authorize"
+microsoft_oauth_client.access_token_endpoint = f"{LOGIN_URL}/{TENANT}/oauth2/v2.0/token"
+microsoft_oauth_client.refresh_token_endpoint = microsoft_oauth_client.access_token_endpoint
+
+# info:{uuid}_me - /users/me cache of the Graph profile, info:{uuid} keeps the last profile for listings
+MICROSOFT_INFO_TTL = 3600 * 24
+MICROSOFT_INFO_STALE_TTL = 7 * 24 * 3600
+
 ALGORITHM = "HS256"
 SECRET = config['Miscellaneous']['secret']
 
@@ -69,7 +88,7 @@ async def get_token_by_microsoft_access_token(token: dict, session: AsyncSession
     # Получение данных пользователя
     async with microsoft_oauth_client.get_httpx_client() as client:
         user_info_response = await client.get(
-            "https://graph.microsoft.com/v1.0/me",
+            f"{GRAPH_URL}/me",
             headers={"Authorization": f"Bearer {token['access_token']}"}
         )
 
@@ -82,25 +101,53 @@ async def get_token_by_microsoft_access_token(token: dict, session: AsyncSession
     user_info = user_info_response.json()
     user_uuid = user_info['id']
 
-    token = create_access_token(
-        user_uuid=user_uuid,
-        microsoft_access_token=access_token,
-        microsoft_refresh_token=refresh_token,
-        expires_at=expires_at
-    )
+    session_id = None
+
+    if SESSION_MODE == "opaque":
+        try:
+            session_id = await create_session(user_uuid, access_token, refresh_token, expires_at)
+        except RedisError:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=SESSION_STORE_UNAVAILABLE
+            )
+
+        token = session_id
+    else:
+        token = create_access_token(
+            user_uuid=user_uuid,
+            microsoft_access_token=access_token,
+            microsoft_refresh_token=refresh_token,
+            expires_at=expires_at
+        )
+
+    db_user = await get_user_by_uuid(user_uuid, session)
 
-    if (await get_user_by_uuid(user_uuid, session)) is None:
+    if db_user is None:
         await create_user(uuid_str=user_uuid, session=session)
 
-        prefix = 'info:'
-        await redis_db.set_dict(f'{prefix}{user_uuid}', user_info)
-        await redis_db.set_dict(f'{prefix}{user_uuid}_temp', 1, ex=3600 * 24)
+        entry, ex = encode_cache_entry(user_info, MICROSOFT_INFO_TTL, MICROSOFT_INFO_STALE_TTL)
+
+        try:
+            async with redis_db.pipeline(transaction=False) as pipe:
+                pipe.set(f'info:{user_uuid}', encode_dict(user_info))
+                pipe.set(get_microsoft_info_cache_key(user_uuid), entry, ex=ex)
 
-    if user_info is not None and "displayName" in user_info:
+                await pipe.execute()
+        except RedisError as e:
+            logging.warning(f"Microsoft profile of {user_uuid} not cached: {e}")
+
+    # The name is kept up to date by services.directory_sync, write only when it differs
+    if "displayName" in user_info and (db_user is None or db_user.name != user_info['displayName']):
         stmt = update(user_db).where(user_db.c.uuid == user_uuid).values(name=user_info['displayName'])
         await session.execute(stmt)
         await session.commit()
 
+        await reset_workers_cache()
+
+    enqueue_profile_photo(user_uuid, access_token)
+    await schedule_token_refresh(user_uuid, refresh_token, expires_at, session_id)
+
     return GetToken(
         token=token
     )
@@ -155,12 +202,111 @@ async def get_default_group(session: AsyncSession) -> GroupRead | None:
     )
 
 
+def select_users_with_group():
+    """
+    Users joined with their group in one query, see read_users_microsoft.
+    """
+
+    return select(
+        user_db.c.uuid,
+        user_db.c.name,
+        user_db.c.is_superuser,
+        user_db.c.group_id,
+        group_db.c.id.label("group_db_id"),
+        group_db.c.name.label("group_name"),
+        group_db.c.permissions.label("group_permissions"),
+        group_db.c.is_default.label("group_is_default"),
+    ).select_from(
+        user_db.outerjoin(group_db, group_db.c.id == user_db.c.group_id)
+    )
+
+
+async def read_users_microsoft(rows: list, session: AsyncSession) -> list[UserReadMicrosoft]:
+    """
+    Build UserReadMicrosoft for rows of select_users_with_group.
+
+    Costs at most one query for the default group and one MGET for the Microsoft data.
+    """
+
+    default_group = None
+    if any(row.group_db_id is None for row in rows):
+        default_group = await get_default_group(session=session)
+
+    microsoft_data = await get_users_microsoft_data([row.uuid for row in rows])
+
+    users = []
+
+    for row, (microsoft_info, image_path) in zip(rows, microsoft_data):
+        group = default_group
+
+        if row.group_db_id is not None:
+            group = GroupRead(
+                id=row.group_db_id,
+                name=row.group_name,
+                permissions=row.group_permissions,
+                is_default=row.group_is_default
+            )
+
+        users.append(
+            UserReadMicrosoft(
+                uuid=row.uuid,
+                is_superuser=row.is_superuser,
+                name=row.name,
+                group=group,
+                microsoft=microsoft_info,
+                image_path=image_path
+            )
+        )
+
+    return users
+
+
+async def get_users_microsoft_data(uuids: list) -> list[tuple[dict | None, str | None]]:
+    """
+    Microsoft profile and image path for every uuid with a single MGET.
+    """
+
+    if not uuids:
+        return []
+
+    keys = []
+    for uuid in uuids:
+        keys.append(f"info:{uuid}")
+        keys.append(f"user_image:{uuid}_value")
+
+    # Listings go out without Microsoft data rather than fail while Redis is unavailable
+    try:
+        values = await redis_db.mget(keys)
+    except RedisError:
+        values = [None] * len(keys)
+
+    result = []
+    for info, image_path in zip(values[::2], values[1::2]):
+        result.append((
+            decode_dict(info),
+            image_path if image_path != "" else None
+        ))
+
+    return result
+
+
+def get_microsoft_info_cache_key(uuid) -> str:
+    return f"info:{uuid}_me"
+
+
 async def get_microsoft_user_info(uuid: str) -> dict | None:
-    return await redis_db.get_dict(f"info:{uuid}")
+    try:
+        return await redis_db.get_dict(f"info:{uuid}")
+    except RedisError:
+        return None
 
 
 async def get_user_image_path(uuid: str) -> str | None:
-    image_path = await redis_db.get(f"user_image:{uuid}_value")
+    try:
+        image_path = await redis_db.get(f"user_image:{uuid}_value")
+    except RedisError:
+        return None
+
     return image_path if image_path != "" else None
 
 
@@ -198,6 +344,10 @@ async def get_current_user(
             detail=TOKEN_NOT_FOUND
         )
 
+    if is_session_token(token):
+        # A session id created here for an expired JWT is the client's new credential
+        return await get_current_user_by_session(request, token, session, new_token=None if repeat else token)
+
     try:
         payload = jwt.decode(token, SECRET, algorithms=[ALGORITHM])
 
@@ -213,10 +363,14 @@ async def get_current_user(
             payload = jwt.decode(token, SECRET, algorithms=[ALGORITHM], options={"verify_exp": False})
             microsoft_refresh_token: str = payload.get("mr_token")
 
-            new_token = await auth_refresh_token(microsoft_refresh_token, session)
+            # Already refreshed by services.token_refresher
+            new_token = await get_refreshed_token(microsoft_refresh_token)
+            if new_token is None:
+                new_token = (await auth_refresh_token(microsoft_refresh_token, session)).token
+
             return await get_current_user(
                 request=request,
-                token=new_token.token,
+                token=new_token,
                 session=session,
                 repeat=False
             )
@@ -228,6 +382,21 @@ async def get_current_user(
 
     except InvalidTokenError:
         raise credentials_exception
+
+    if repeat and microsoft_refresh_token is not None and is_refresh_due(payload["exp"]):
+        new_token = await get_refreshed_token(microsoft_refresh_token)
+
+        if new_token is not None:
+            return await get_current_user(
+                request=request,
+                token=new_token,
+                session=session,
+                repeat=False
+            )
+
+    elif not repeat and microsoft_refresh_token is not None:
+        # The client receives this token now, keep refreshing its session
+        await schedule_token_refresh(user_uuid, microsoft_refresh_token, payload["exp"])
     
 
     user = await get_user_by_uuid(user_uuid, session)
@@ -252,6 +421,70 @@ async def get_current_user(
     return user
 
 
+async def get_current_user_by_session(request: Request, session_id: str, session: AsyncSession, new_token: str | None = None) -> UserToken:
+    """
+    get_current_user for opaque tokens, one HGETALL while the cached user is fresh.
+
+    `new_token` is handed to the client, set when the session replaces its expired JWT.
+    """
+
+    try:
+        data = await get_session(session_id)
+    except RedisError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=SESSION_STORE_UNAVAILABLE
+        )
+
+    if data is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=INVALID_TOKEN
+        )
+
+    # Normally services.token_refresher gets here first
+    if int(data["expires_at"]) <= datetime.now(timezone.utc).timestamp():
+        try:
+            token = await microsoft_oauth_client.refresh_token(refresh_token=data["mr_token"])
+        except RefreshTokenError:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail=TOKEN_HAS_EXPIRED
+            )
+
+        await update_session_tokens(session_id, token["access_token"], token["refresh_token"], token["expires_at"])
+        await schedule_token_refresh(data["uuid"], token["refresh_token"], token["expires_at"], session_id)
+
+        data["ma_token"] = token["access_token"]
+        data["mr_token"] = token["refresh_token"]
+
+    user = get_session_user(data)
+
+    if user is None:
+        user = await get_user_by_uuid(data["uuid"], session)
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail=FAILED_FETCH_USER_INFO
+            )
+
+        try:
+            await set_session_user(session_id, user)
+        except RedisError:
+            pass
+
+    user = UserToken(
+        microsoft_access_token=data["ma_token"],
+        microsoft_refresh_token=data["mr_token"],
+        new_token=new_token,
+        **user.model_dump()
+    )
+
+    request.state.__auth_user_data = user
+
+    return user
+
+
 async def get_current_user_optional(
         request: Request,
         token: str | None = Security(api_key_header),
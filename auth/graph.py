@@ -0,0 +1,74 @@
+from typing import AsyncIterator
+
+import httpx
+
+from config import config
+
+# Both can point to a local stand-in server when testing
+GRAPH_URL = config['Microsoft']['graph_url'].rstrip('/')
+LOGIN_URL = config['Microsoft']['login_url'].rstrip('/')
+
+CLIENT_ID = config['Microsoft']['client_id']
+CLIENT_SECRET = config['Microsoft']['client_secret']
+TENANT = config.get('Microsoft', 'tenant_id', 'common')
+
+# The fields /me returns by default, so synced blobs look like the ones cached at login
+USER_SELECT = ",".join([
+    "id",
+    "displayName",
+    "givenName",
+    "surname",
+    "jobTitle",
+    "mail",
+    "mobilePhone",
+    "businessPhones",
+    "officeLocation",
+    "preferredLanguage",
+    "userPrincipalName",
+])
+
+
+class DeltaLinkExpired(Exception):
+    pass
+
+
+async def get_application_token(client: httpx.AsyncClient) -> str:
+    """
+    App-only token (client credentials) for directory-wide Graph queries.
+    """
+
+    response = await client.post(
+        f"{LOGIN_URL}/{TENANT}/oauth2/v2.0/token",
+        data={
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET,
+            "scope": "https://graph.microsoft.com/.default",
+            "grant_type": "client_credentials",
+        }
+    )
+    response.raise_for_status()
+
+    return response.json()["access_token"]
+
+
+async def iterate_users_delta(client: httpx.AsyncClient, token: str, delta_link: str | None = None) -> AsyncIterator[tuple[list[dict], str | None]]:
+    """
+    Yield pages of users changed since `delta_link` (all users without it).
+
+    The last page comes with the delta link for the next run.
+    """
+
+    url = delta_link or f"{GRAPH_URL}/users/delta?$select={USER_SELECT}"
+
+    while url:
+        response = await client.get(url, headers={"Authorization": f"Bearer {token}"})
+
+        if response.status_code == 410 and delta_link is not None:
+            raise DeltaLinkExpired()
+
+        response.raise_for_status()
+        data = response.json()
+
+        yield data.get("value", []), data.get("@odata.deltaLink")
+
+        url = data.get("@odata.nextLink")
@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+import httpx
+
+from database import redis_db
+from images import image_storage, run_in_process_pool, resize_image
+from .graph import GRAPH_URL
+from .workers_cache import reset_workers_cache
+
+# The largest size is stored as `<uuid>_<content hash>.jpeg` (the user's image_path),
+# the others as `<uuid>_<content hash>_<size>.jpeg`
+PHOTO_SIZES = (64, 128, 256, 512)
+PHOTO_EXTENSION = ".jpeg"
+
+# user_image_path:{uuid} - redis_db.cached entry, fresh while the photo was revalidated with Graph recently
+PHOTO_FRESH_TTL = 7200
+# user_image_expiry - sorted set of user uuids scored by the deadline of their photo files,
+# services.tmp_image_remover removes the files of due entries
+PHOTO_RETENTION_TTL = 30 * 24 * 3600
+PHOTO_EXPIRY_KEY = "user_image_expiry"
+
+profile_photo_queue: asyncio.Queue[tuple[str, str]] = asyncio.Queue()
+queued_profile_photos: set[str] = set()
+
+
+def get_photo_file_name(file_name: str, size: int) -> str:
+    if size == PHOTO_SIZES[-1]:
+        return file_name
+
+    stem, extension = os.path.splitext(file_name)
+    return f"{stem}_{size}{extension}"
+
+
+def get_photo_file_names(file_name: str) -> list[str]:
+    return [get_photo_file_name(file_name, size) for size in PHOTO_SIZES]
+
+
+def get_photo_cache_key(user_uuid) -> str:
+    return f"user_image_path:{user_uuid}"
+
+
+def enqueue_profile_photo(user_uuid, microsoft_access_token: str):
+    """
+    Schedule a background download of the user's Microsoft photo, see services.profile_photo_fetcher.
+    """
+
+    user_uuid = str(user_uuid)
+
+    if user_uuid in queued_profile_photos:
+        return
+
+    queued_profile_photos.add(user_uuid)
+    profile_photo_queue.put_nowait((user_uuid, microsoft_access_token))
+
+
+def get_photo_name(user_uuid: str, content: bytes) -> str:
+    """
+    Stable per-user name that only changes together with the photo.
+    """
+
+    return f"{user_uuid}_{hashlib.sha256(content).hexdigest()[:16]}{PHOTO_EXTENSION}"
+
+
+async def fetch_profile_photo(user_uuid: str, microsoft_access_token: str) -> str | None:
+    """
+    Revalidate the user's photo with a conditional Graph request, returns the image path.
+
+    Files are rewritten only when the photo content changes.
+    """
+
+    prefix = 'user_image:'
+
+    current_path, etag = await redis_db.mget([f"{prefix}{user_uuid}_value", f"{prefix}{user_uuid}_etag"])
+
+    headers = {"Authorization": f"Bearer {microsoft_access_token}"}
+    if current_path and etag:
+        headers["If-None-Match"] = etag
+
+    async with httpx.AsyncClient() as client:
+        user_photo_response = await client.get(
+            f"{GRAPH_URL}/me/photo/$value",
+            headers=headers
+        )
+
+    if user_photo_response.status_code == 304:
+        image_path = current_path
+
+    elif user_photo_response.status_code == 200:
+        content = user_photo_response.content
+        image_path = get_photo_name(user_uuid, content)
+        etag = user_photo_response.headers.get("ETag")
+
+        if image_path != current_path:
+            variants = await run_in_process_pool(resize_image, content, PHOTO_SIZES)
+            files = {get_photo_file_name(image_path, size): variant for size, variant in variants.items()}
+            await asyncio.gather(*(
+                image_storage.put_bytes(file_name, content, "image/jpeg") for file_name, content in files.items()
+            ))
+
+    elif user_photo_response.status_code == 404:
+        # The user has no photo (any more)
+        image_path = ""
+        etag = None
+
+    else:
+        # Expired token, throttling, Graph outage: keep what is stored
+        logging.info(f"Photo of {user_uuid} not revalidated, Graph returned {user_photo_response.status_code}")
+        return current_path or None
+
+    if current_path and current_path != image_path:
+        await image_storage.delete(*get_photo_file_names(current_path))
+
+    async with redis_db.pipeline(transaction=False) as pipe:
+        pipe.zadd(PHOTO_EXPIRY_KEY, {user_uuid: time.time() + PHOTO_RETENTION_TTL})
+        pipe.set(f"{prefix}{user_uuid}_value", image_path)
+
+        if etag:
+            pipe.set(f"{prefix}{user_uuid}_etag", etag)
+        else:
+            pipe.delete(f"{prefix}{user_uuid}_etag")
+
+        await pipe.execute()
+
+    # Worker listings embed the photo path
+    if image_path != current_path:
+        await reset_workers_cache()
+
+    return image_path or None
@@ -0,0 +1,88 @@
+import secrets
+import time
+
+from config import config
+from database import redis_db
+from schemas import UserRead
+
+# "jwt" - the Microsoft tokens travel inside the JWT, "opaque" - the client holds a session id
+SESSION_MODE = config["Session"]["mode"]
+# Sliding, every request extends it
+SESSION_TTL = int(config.get("Session", "ttl", 7 * 24 * 3600))
+# How long the resolved user and group are trusted before they are read from the database again
+SESSION_USER_TTL = int(config.get("Session", "user_ttl", 60))
+
+SESSION_PREFIX = "session:"
+
+
+def is_session_token(token: str) -> bool:
+    # token_urlsafe never contains dots, a JWT always does
+    return "." not in token
+
+
+async def create_session(user_uuid, microsoft_access_token: str, microsoft_refresh_token: str, expires_at: int) -> str:
+    session_id = secrets.token_urlsafe(32)
+    key = f"{SESSION_PREFIX}{session_id}"
+
+    async with redis_db.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping={
+            "uuid": str(user_uuid),
+            "ma_token": microsoft_access_token,
+            "mr_token": microsoft_refresh_token,
+            "expires_at": expires_at,
+            "user_expires_at": 0
+        })
+        pipe.expire(key, SESSION_TTL)
+
+        await pipe.execute()
+
+    return session_id
+
+
+async def get_session(session_id: str) -> dict | None:
+    """
+    Load a session and extend its TTL in one round trip.
+    """
+
+    key = f"{SESSION_PREFIX}{session_id}"
+
+    async with redis_db.pipeline(transaction=False) as pipe:
+        pipe.hgetall(key)
+        pipe.expire(key, SESSION_TTL)
+
+        data, _ = await pipe.execute()
+
+    return data or None
+
+
+async def update_session_tokens(session_id: str, microsoft_access_token: str, microsoft_refresh_token: str, expires_at: int) -> bool:
+    """
+    Store refreshed Microsoft tokens, returns False when the session is gone.
+    """
+
+    key = f"{SESSION_PREFIX}{session_id}"
+
+    if not await redis_db.exists(key):
+        return False
+
+    await redis_db.hset(key, mapping={
+        "ma_token": microsoft_access_token,
+        "mr_token": microsoft_refresh_token,
+        "expires_at": expires_at
+    })
+
+    return True
+
+
+def get_session_user(data: dict) -> UserRead | None:
+    if "user" not in data or float(data["user_expires_at"]) < time.time():
+        return None
+
+    return UserRead.model_validate_json(data["user"])
+
+
+async def set_session_user(session_id: str, user: UserRead):
+    await redis_db.hset(f"{SESSION_PREFIX}{session_id}", mapping={
+        "user": user.model_dump_json(),
+        "user_expires_at": time.time() + SESSION_USER_TTL
+    })
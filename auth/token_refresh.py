@@ -0,0 +1,72 @@
+import hashlib
+import logging
+import time
+
+from redis.exceptions import RedisError
+
+from config import config
+from database import redis_db, encode_dict
+
+# Sessions are refreshed this many seconds before their Microsoft token expires
+TOKEN_REFRESH_LEAD = int(config.get("Microsoft", "token_refresh_lead", 300))
+
+# token_refresh:schedule - sorted set of session ids scored by expires_at
+SCHEDULE_KEY = "token_refresh:schedule"
+SESSION_PREFIX = "token_refresh:session:"
+REFRESHED_PREFIX = "token_refresh:refreshed:"
+
+
+def get_session_id(microsoft_refresh_token: str) -> str:
+    return hashlib.sha256(microsoft_refresh_token.encode()).hexdigest()[:32]
+
+
+def is_refresh_due(expires_at: int) -> bool:
+    return expires_at - time.time() <= TOKEN_REFRESH_LEAD
+
+
+async def schedule_token_refresh(user_uuid, microsoft_refresh_token: str, expires_at: int, session_id: str | None = None):
+    """
+    Track a session so services.token_refresher renews it before `expires_at`.
+
+    Called on login and when a client picks up a refreshed token, so sessions
+    nobody uses anymore are refreshed at most once. Opaque sessions (`session_id`)
+    are refreshed in place for as long as their hash lives.
+    """
+
+    refresh_id = get_session_id(microsoft_refresh_token)
+    ttl = max(int(expires_at - time.time()), 0) + TOKEN_REFRESH_LEAD
+
+    # Without Redis the session is refreshed on the first request after it expires
+    try:
+        async with redis_db.pipeline(transaction=False) as pipe:
+            pipe.set(
+                f"{SESSION_PREFIX}{refresh_id}",
+                encode_dict({
+                    "uuid": str(user_uuid),
+                    "refresh_token": microsoft_refresh_token,
+                    "expires_at": expires_at,
+                    "session_id": session_id
+                }),
+                ex=ttl
+            )
+            pipe.zadd(SCHEDULE_KEY, {refresh_id: expires_at})
+
+            await pipe.execute()
+    except RedisError as e:
+        logging.warning(f"Token refresh of {user_uuid} not scheduled: {e}")
+
+
+async def set_refreshed_token(microsoft_refresh_token: str, token: str, expires_at: int):
+    ttl = max(int(expires_at - time.time()), 1)
+    await redis_db.set(f"{REFRESHED_PREFIX}{get_session_id(microsoft_refresh_token)}", token, ex=ttl)
+
+
+async def get_refreshed_token(microsoft_refresh_token: str) -> str | None:
+    """
+    JWT issued by services.token_refresher to replace the one holding `microsoft_refresh_token`.
+    """
+
+    try:
+        return await redis_db.get(f"{REFRESHED_PREFIX}{get_session_id(microsoft_refresh_token)}")
+    except RedisError:
+        return None
@@ -0,0 +1,20 @@
+import logging
+
+from redis.exceptions import RedisError
+
+from database import redis_db
+
+# routers.workers caches the listing together with the names, groups and photos of the workers
+WORKERS_CACHE_KEY = "workers"
+WORKERS_CACHE_TTL = 300
+
+
+async def reset_workers_cache():
+    """
+    Drop the cached worker listing, called after anything it shows has changed.
+    """
+
+    try:
+        await redis_db.delete(WORKERS_CACHE_KEY)
+    except RedisError as e:
+        logging.warning(f"Workers cache not reset, it expires in {WORKERS_CACHE_TTL} seconds: {e}")
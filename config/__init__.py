@@ -12,7 +12,17 @@ config = Configure(default_config={
         "host": "redis",
         "port": 6379,
         "login": "",
-        "password": ""
+        "password": "",
+        "compress_threshold": 1024,
+        "l1_size": 0,
+        "l1_ttl": 5,
+        "l1_prefixes": ["info:", "user_image:", "user_image_path:"],
+        "command_timeout": 0.5,
+        "connect_timeout": 0.5,
+        "breaker_threshold": 5,
+        "breaker_reset_timeout": 10,
+        "fallback_cache_size": 1000,
+        "fallback_cache_ttl": 60,
     },
     "Miscellaneous": {
         "Secret": "",
@@ -23,6 +33,44 @@ config = Configure(default_config={
         "client_id": "",
         "client_secret": "",
         "tenant_id": "",
-        "redirect_url": "http://localhost:8000/auth/microsoft/token"
+        "redirect_url": "http://localhost:8000/auth/microsoft/token",
+        "graph_url": "https://graph.microsoft.com/v1.0",
+        "login_url": "https://login.microsoftonline.com",
+        "directory_sync_interval": 3600,
+        "token_refresh_lead": 300,
+        "token_refresh_interval": 30,
+    },
+    "Session": {
+        "mode": "jwt",
+        "ttl": 604800,
+        "user_ttl": 60,
+    },
+    "ActionHistory": {
+        "mode": "buffer",
+        "stream_batch_size": 500,
+        "hot_months": 3,
+        "retention_months": 12,
+        "partitions_ahead": 2,
+        "archive_dir": "./archive/action_history",
+    },
+    "Images": {
+        "process_workers": 2,
+        "max_upload_size": 10485760,
+        "variant_widths": [320, 640, 1280],
+        "gc_interval": 86400,
+        "gc_grace_period": 86400,
+        "gc_page_size": 500,
+        "photo_expiry_interval": 60,
+    },
+    "Storage": {
+        "backend": "local",
+        "endpoint_url": "http://minio:9000",
+        "bucket": "probook",
+        "region": "us-east-1",
+        "access_key": "",
+        "secret_key": "",
+        "public_url": "",
+        "url_ttl": 3600,
+        "part_size": 8388608,
     }
 })
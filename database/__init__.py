@@ -1,2 +1,4 @@
 from .database import *
-from .redis_ import redis_db, create_connection
\ No newline at end of file
+from .redis_ import redis_db, create_connection, encode_dict, decode_dict, encode_cache_entry
+from .circuit_breaker import RedisUnavailableError
+from .json_ import json_dumps, json_dumps_bytes, json_loads, hex_uuids
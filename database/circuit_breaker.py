@@ -0,0 +1,57 @@
+import time
+
+from redis.exceptions import ConnectionError
+
+
+class RedisUnavailableError(ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops calling a dependency after `failure_threshold` consecutive failures.
+
+    Once `reset_timeout` seconds pass a single trial call is let through,
+    its result closes the circuit or opens it for another period.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial_running = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+
+        if self._trial_running or time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+
+        self._trial_running = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def release_trial(self):
+        """
+        The trial call ended without an outcome, the next call becomes the trial.
+        """
+
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_running = False
+
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
@@ -10,10 +10,15 @@ from sqlalchemy import update, select, insert, delete
 import uuid
 
 from models_ import user, group
+from .json_ import json_dumps, json_loads
 
 DATABASE_URL =  f"postgresql+asyncpg://{config['Database']['DB_USER']}:{config['Database']['DB_PASS']}@{config['Database']['DB_HOST']}:{config['Database']['DB_PORT']}/{config['Database']['DB_NAME']}"
 
-engine = create_async_engine(DATABASE_URL)
+engine = create_async_engine(
+    DATABASE_URL,
+    json_serializer=json_dumps,
+    json_deserializer=json_loads
+)
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
 SECRET = config['Miscellaneous']['secret']
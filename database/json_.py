@@ -0,0 +1,63 @@
+from collections.abc import Mapping
+from typing import Any
+from uuid import UUID
+
+from pydantic import BaseModel
+from sqlalchemy.engine import Row
+import orjson
+
+# UUID, datetime, date and Enum are encoded by orjson itself
+OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def orjson_default(obj: Any):
+    if isinstance(obj, Row):
+        return dict(obj._mapping)
+
+    if isinstance(obj, Mapping):
+        return dict(obj)
+
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def hex_uuids(obj: Any) -> Any:
+    """
+    Copy of `obj` with UUIDs as 32 hex digits, how action history detail stored them before orjson.
+
+    Entries are filtered by `detail @>`, so new ones must match the rows already written.
+    """
+
+    if isinstance(obj, UUID):
+        return obj.hex
+
+    if isinstance(obj, Row):
+        obj = obj._mapping
+
+    if isinstance(obj, BaseModel):
+        obj = obj.model_dump()
+
+    if isinstance(obj, Mapping):
+        return {key: hex_uuids(value) for key, value in obj.items()}
+
+    if isinstance(obj, (list, set, frozenset, tuple)):
+        return [hex_uuids(value) for value in obj]
+
+    return obj
+
+
+def json_dumps_bytes(obj: Any) -> bytes:
+    return orjson.dumps(obj, default=orjson_default, option=OPTIONS)
+
+
+def json_dumps(obj: Any) -> str:
+    return json_dumps_bytes(obj).decode()
+
+
+def json_loads(data: str | bytes) -> Any:
+    return orjson.loads(data)
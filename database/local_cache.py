@@ -0,0 +1,56 @@
+import time
+from collections import OrderedDict
+from typing import Any, Iterable
+
+
+class LocalCache:
+    """
+    Bounded in-process LRU with a per-entry TTL.
+
+    Values are only kept while `active`, i.e. while the worker receives
+    invalidations. `generation` changes on every eviction, so a value read
+    before an invalidation arrived is not stored after it.
+    """
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self.active = False
+        self.generation = 0
+
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> tuple[bool, Any]:
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return False, None
+
+        expires_at, value = entry
+
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return False, None
+
+        self._entries.move_to_end(key)
+        return True, value
+
+    def put(self, key: str, value: Any, generation: int):
+        if not self.active or generation != self.generation:
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def evict(self, keys: Iterable[str]):
+        self.generation += 1
+
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
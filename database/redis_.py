@@ -1,22 +1,313 @@
-from redis.asyncio.client import Redis
+from redis.asyncio.client import Redis, Pipeline
+from redis.exceptions import ConnectionError, TimeoutError, RedisError
 from redis.typing import (
     AbsExpiryT,
     ExpiryT,
     KeyT
 )
-import json
-from typing import Union, Optional, Any
+import asyncio
+import base64
+import contextlib
+import contextvars
+import logging
+import math
+import random
+import secrets
+import time
+import zlib
+from typing import Union, Optional, Any, Awaitable, Callable
 
 from config import config
+from .json_ import json_dumps, json_loads
+from .local_cache import LocalCache
+from .circuit_breaker import CircuitBreaker, RedisUnavailableError
+
+# Dicts encoded longer than this are stored zlib-compressed
+COMPRESS_THRESHOLD = int(config.get("Redis", "compress_threshold", 1024))
+COMPRESSED_MARKER = "z:"
+
+# In-process tier in front of Redis for hot keys, 0 disables it. Workers evict each
+# other's copies through L1_INVALIDATION_CHANNEL, see services.cache_invalidation
+L1_SIZE = int(config.get("Redis", "l1_size", 0))
+L1_TTL = float(config.get("Redis", "l1_ttl", 5))
+L1_PREFIXES = tuple(config.get("Redis", "l1_prefixes", ["info:", "user_image:", "user_image_path:"]))
+L1_INVALIDATION_CHANNEL = "l1_invalidate"
+
+# Request-path commands fail after this many seconds, blocking reads (BLOCK) are not limited
+COMMAND_TIMEOUT = float(config.get("Redis", "command_timeout", 0.5))
+CONNECT_TIMEOUT = float(config.get("Redis", "connect_timeout", 0.5))
+# Consecutive failures that open the circuit and for how long it stays open
+BREAKER_THRESHOLD = int(config.get("Redis", "breaker_threshold", 5))
+BREAKER_RESET_TIMEOUT = float(config.get("Redis", "breaker_reset_timeout", 10))
+# redis_db.cached falls back to this in-process cache while Redis is unavailable
+FALLBACK_CACHE_SIZE = int(config.get("Redis", "fallback_cache_size", 1000))
+FALLBACK_CACHE_TTL = float(config.get("Redis", "fallback_cache_ttl", 60))
+
+# Deletes a lock only while it still holds the owner's token, an expired lock may belong to another worker
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+BLOCKING_COMMANDS = {"BLPOP", "BRPOP", "BLMOVE", "BZPOPMIN", "BZPOPMAX"}
+
+# Set by CustomRedisClient.command_timeout, overrides COMMAND_TIMEOUT for the current task
+_command_timeout_override = contextvars.ContextVar("command_timeout_override", default=COMMAND_TIMEOUT)
+
+# Commands that change the value of the keys they take
+WRITE_COMMANDS = {"SET", "SETEX", "SETNX", "GETDEL", "GETEX", "APPEND", "DEL", "UNLINK", "MSET"}
+
+# Commands whose first argument is the only key
+SINGLE_KEY_COMMANDS = {
+    "GET", "SET", "SETEX", "SETNX", "GETDEL", "GETEX", "INCR", "INCRBY", "DECR",
+    "EXPIRE", "PEXPIRE", "EXPIREAT", "TTL", "PTTL",
+    "HSET", "HGET", "HGETALL", "HDEL", "HINCRBY",
+    "ZADD", "ZREM", "ZSCORE", "ZCARD", "ZRANGE", "ZRANGEBYSCORE",
+    "SADD", "SREM", "SMEMBERS", "LPUSH", "RPUSH", "LRANGE", "XADD",
+}
+# Commands where every argument is a key
+MULTI_KEY_COMMANDS = {"DEL", "UNLINK", "EXISTS", "TOUCH", "MGET", "WATCH"}
+
+
+def _is_option(arg, name: str) -> bool:
+    if isinstance(arg, bytes):
+        arg = arg.decode(errors="ignore")
+
+    return isinstance(arg, str) and arg.upper() == name
+
+
+def get_command_timeout(args: tuple) -> float | None:
+    command = str(args[0]).upper()
+
+    # redis-py passes options as bytes (b"BLOCK")
+    if command in BLOCKING_COMMANDS or (command in ("XREAD", "XREADGROUP") and any(_is_option(arg, "BLOCK") for arg in args)):
+        return None
+
+    return _command_timeout_override.get()
+
+
+def get_written_keys(args: tuple) -> list[str]:
+    command = str(args[0]).upper()
+
+    if command not in WRITE_COMMANDS:
+        return []
+
+    if command == "MSET":
+        return list(args[1::2])
+
+    if command in ("DEL", "UNLINK"):
+        return list(args[1:])
+
+    return [args[1]]
+
+
+def encode_dict(data) -> str:
+    value = json_dumps(data)
+
+    if len(value) > COMPRESS_THRESHOLD:
+        value = COMPRESSED_MARKER + base64.b64encode(zlib.compress(value.encode())).decode()
+
+    return value
+
+
+def decode_dict(value: str | None):
+    if not value:
+        return None
+
+    if value.startswith(COMPRESSED_MARKER):
+        value = zlib.decompress(base64.b64decode(value[len(COMPRESSED_MARKER):]))
+
+    return json_loads(value)
+
+
+def encode_cache_entry(value, ttl: int, stale_ttl: int = 0, delta: float = 0.0) -> tuple[str, int]:
+    """
+    Envelope used by CustomRedisClient.cached and the expiry to store it with.
+
+    `e` is the logical expiry, the key itself lives `stale_ttl` longer so stale
+    values can be served while they are recomputed. `d` is how long the loader took.
+    """
+
+    entry = encode_dict({"v": value, "e": time.time() + ttl, "d": delta})
+    return entry, max(int(ttl + stale_ttl), 1)
+
+
+class CustomPipeline(Pipeline):
+    """
+    Pipeline that prefixes keys the same way as CustomRedisClient.
+    """
+
+    def __init__(self, client: "CustomRedisClient", key_prefix: str = None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.client = client
+        self.key_prefix = key_prefix
+
+    def _add_prefix(self, key: KeyT):
+        return f"{self.key_prefix}:{key}" if self.key_prefix else key
+
+    def execute_command(self, *args, **kwargs):
+        command = str(args[0]).upper()
+
+        if command in SINGLE_KEY_COMMANDS:
+            args = (args[0], self._add_prefix(args[1]), *args[2:])
+        elif command in MULTI_KEY_COMMANDS:
+            args = (args[0], *[self._add_prefix(key) for key in args[1:]])
+        elif command == "MSET":
+            args = (args[0], *[self._add_prefix(arg) if i % 2 == 0 else arg for i, arg in enumerate(args[1:])])
+
+        return super().execute_command(*args, **kwargs)
+
+    async def execute(self, raise_on_error: bool = True):
+        written_keys = [key for args, _ in self.command_stack for key in get_written_keys(args)]
+        response = await self.client._guarded(super().execute(raise_on_error), _command_timeout_override.get())
+
+        await self.client._invalidate_l1(written_keys)
+        return response
 
 class CustomRedisClient(Redis):
     def __init__(self, key_prefix: str = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.key_prefix = key_prefix
+        self._cache_loads: dict[str, asyncio.Task] = {}
+
+        self.l1 = LocalCache(L1_SIZE, L1_TTL) if L1_SIZE > 0 else None
+        self.breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET_TIMEOUT)
+
+        self.fallback = LocalCache(FALLBACK_CACHE_SIZE, FALLBACK_CACHE_TTL)
+        self.fallback.active = True
+        self._l1_prefixes = tuple(self._add_prefix(prefix) for prefix in L1_PREFIXES)
     
     def _add_prefix(self, key: KeyT):
         return f"{self.key_prefix}:{key}" if self.key_prefix else key
+
+    def _is_l1_key(self, key) -> bool:
+        return isinstance(key, str) and key.startswith(self._l1_prefixes)
+
+    async def _guarded(self, awaitable, timeout: float | None):
+        """
+        Run a Redis call behind the circuit breaker, so an unreachable Redis
+        costs one fast RedisUnavailableError instead of a hanging request.
+        """
+
+        if not self.breaker.allow():
+            awaitable.close()
+            raise RedisUnavailableError("Redis is unavailable")
+
+        try:
+            response = await asyncio.wait_for(awaitable, timeout)
+        except (ConnectionError, TimeoutError, asyncio.TimeoutError, OSError) as e:
+            self.breaker.record_failure()
+            raise RedisUnavailableError(str(e) or "Redis call timed out") from e
+        except RedisError:
+            # An error reply (WRONGTYPE, NOSCRIPT, ...) still means Redis answered
+            self.breaker.record_success()
+            raise
+        except BaseException:
+            # Cancelled before an answer, nothing is known about Redis
+            self.breaker.release_trial()
+            raise
+
+        self.breaker.record_success()
+        return response
+
+    @contextlib.contextmanager
+    def command_timeout(self, timeout: float | None):
+        """
+        Use `timeout` instead of COMMAND_TIMEOUT for the calls made inside the block, None disables it.
+        """
+
+        token = _command_timeout_override.set(timeout)
+
+        try:
+            yield
+        finally:
+            _command_timeout_override.reset(token)
+
+    async def _execute_command(self, *args, **options):
+        return await self._guarded(super().execute_command(*args, **options), get_command_timeout(args))
+
+    async def execute_command(self, *args, **options):
+        command = str(args[0]).upper()
+
+        if self.l1 is not None and self.l1.active:
+            if command == "GET" and self._is_l1_key(args[1]):
+                return await self._l1_get(args, options)
+
+            if command == "MGET":
+                return await self._l1_mget(args, options)
+
+        response = await self._execute_command(*args, **options)
+
+        await self._invalidate_l1(get_written_keys(args))
+        return response
+
+    async def _l1_get(self, args: tuple, options: dict):
+        hit, value = self.l1.get(args[1])
+        if hit:
+            return value
+
+        generation = self.l1.generation
+        value = await self._execute_command(*args, **options)
+
+        if value is not None:
+            self.l1.put(args[1], value, generation)
+
+        return value
+
+    async def _l1_mget(self, args: tuple, options: dict):
+        keys = list(args[1:])
+        values = [None] * len(keys)
+        missing = []
+
+        for i, key in enumerate(keys):
+            hit = False
+            if self._is_l1_key(key):
+                hit, values[i] = self.l1.get(key)
+
+            if not hit:
+                missing.append(i)
+
+        if not missing:
+            return values
+
+        generation = self.l1.generation
+        options.pop("keys", None)
+        response = await self._execute_command("MGET", *[keys[i] for i in missing], **options)
+
+        for i, value in zip(missing, response):
+            values[i] = value
+
+            if value is not None and self._is_l1_key(keys[i]):
+                self.l1.put(keys[i], value, generation)
+
+        return values
+
+    async def _invalidate_l1(self, keys: list[str]):
+        if self.l1 is None:
+            return
+
+        keys = [key for key in keys if self._is_l1_key(key)]
+        if not keys:
+            return
+
+        self.l1.evict(keys)
+
+        # The write already succeeded, other workers' copies expire within L1_TTL anyway
+        try:
+            await self._execute_command("PUBLISH", self._add_prefix(L1_INVALIDATION_CHANNEL), "\n".join(keys))
+        except RedisError as e:
+            logging.warning(f"L1 invalidation of {len(keys)} keys not published: {e}")
+
+    async def invalidate_l1(self, *keys: str):
+        """
+        Evict keys written by a script from every worker's L1, EVAL is not inspected.
+        """
+
+        await self._invalidate_l1([self._add_prefix(key) for key in keys])
     
     async def get(self, key: str, *args, **kwargs) -> Optional[Any]:
         prefixed_key = self._add_prefix(key)
@@ -37,7 +328,23 @@ class CustomRedisClient(Redis):
     async def delete(self, *keys: str) -> int:
         prefixed_keys = [self._add_prefix(key) for key in keys]
         return await super().delete(*prefixed_keys)
-    
+
+    async def mget(self, keys: list[str], *args) -> list[Optional[Any]]:
+        prefixed_keys = [self._add_prefix(key) for key in [*keys, *args]]
+        return await super().mget(prefixed_keys)
+
+    async def mset(self, mapping: dict[str, Any]) -> bool:
+        return await super().mset({self._add_prefix(key): value for key, value in mapping.items()})
+
+    async def exists(self, *keys: str) -> int:
+        return await super().exists(*[self._add_prefix(key) for key in keys])
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> CustomPipeline:
+        return CustomPipeline(self, self.key_prefix, self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+    def pipeline_abs(self, transaction: bool = True, shard_hint: Optional[str] = None) -> CustomPipeline:
+        return CustomPipeline(self, None, self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
 
     async def get_abs(self, key: str, *args, **kwargs) -> Optional[Any]:
         return await super().get(key, *args, **kwargs)
@@ -58,13 +365,154 @@ class CustomRedisClient(Redis):
     async def set_dict(self, key: KeyT, data: dict, ex: Union[ExpiryT, None] = None, px: Union[ExpiryT, None] = None, nx: bool = False, xx: bool = False, keepttl: bool = False, get: bool = False, exat: Union[AbsExpiryT, None] = None, pxat: Union[AbsExpiryT, None] = None):
         await self.set(
             key=key,
-            value=json.dumps(data),
+            value=encode_dict(data),
             ex=ex, px=px, nx=nx, xx=xx, keepttl=keepttl, get=get, exat=exat, pxat=pxat
         )
 
     async def get_dict(self, key: KeyT):
-        json_data = await self.get(key)
-        return dict(json.loads(json_data)) if json_data else None
+        data = decode_dict(await self.get(key))
+        return dict(data) if data is not None else None
+
+    async def set_dict_many(self, mapping: dict[str, Any], ex: Union[ExpiryT, None] = None):
+        """
+        Store several dicts in one round trip, with MSET when there is no expiry.
+        """
+
+        if not mapping:
+            return
+
+        if ex is None:
+            await self.mset({key: encode_dict(data) for key, data in mapping.items()})
+            return
+
+        async with self.pipeline(transaction=False) as pipe:
+            for key, data in mapping.items():
+                pipe.set(key, encode_dict(data), ex=ex)
+
+            await pipe.execute()
+
+    async def get_dict_many(self, keys: list[str]) -> list[Optional[dict]]:
+        if not keys:
+            return []
+
+        return [decode_dict(value) for value in await self.mget(keys)]
+
+
+    async def set_cached(self, key: str, value, ttl: int, stale_ttl: int = 0):
+        entry, ex = encode_cache_entry(value, ttl, stale_ttl)
+        await self.set(key, entry, ex=ex)
+
+    async def cached(
+            self,
+            key: str,
+            ttl: int,
+            loader: Callable[[], Awaitable[Any]],
+            stale_ttl: int = 0,
+            negative_ttl: int | None = None,
+            beta: float = 1.0,
+            lock_timeout: int = 10
+        ):
+        """
+        Get-or-compute with stampede protection.
+
+        A missing key is computed by one caller across all workers (`<key>_lock`),
+        the others wait for its result. Fresh values are recomputed early with
+        probability growing towards expiry (XFetch), stale values are served
+        while a background refresh runs. `None` is cached for `negative_ttl`.
+
+        While Redis is unavailable values are kept in the in-process fallback cache.
+        """
+
+        try:
+            entry = decode_dict(await self.get(key))
+
+            if entry is None:
+                return await self._load_cached(key, ttl, loader, stale_ttl, negative_ttl, lock_timeout)
+
+        except RedisError:
+            return await self._load_cached_locally(key, loader)
+
+        if time.time() - entry["d"] * beta * math.log(random.random() or 1e-12) >= entry["e"]:
+            self._refresh_cached(key, ttl, loader, stale_ttl, negative_ttl, lock_timeout)
+
+        return entry["v"]
+
+    def _refresh_cached(self, key: str, *args):
+        if key in self._cache_loads:
+            return
+
+        async def refresh():
+            try:
+                await self._load_cached(key, *args)
+            except Exception as e:
+                logging.exception(e)
+
+        asyncio.create_task(refresh())
+
+    async def _load_cached(self, key: str, *args):
+        # Callers in this process share one load
+        task = self._cache_loads.get(key)
+
+        if task is None:
+            task = asyncio.create_task(self._load_cached_locked(key, *args))
+            self._cache_loads[key] = task
+            task.add_done_callback(lambda _: self._cache_loads.pop(key, None))
+
+        return await asyncio.shield(task)
+
+    async def _load_cached_locally(self, key: str, loader):
+        hit, value = self.fallback.get(key)
+        if hit:
+            return value
+
+        local_key = f"fallback:{key}"
+        task = self._cache_loads.get(local_key)
+
+        if task is None:
+            task = asyncio.create_task(loader())
+            self._cache_loads[local_key] = task
+            task.add_done_callback(lambda _: self._cache_loads.pop(local_key, None))
+
+        value = await asyncio.shield(task)
+        self.fallback.put(key, value, self.fallback.generation)
+
+        return value
+
+    async def _load_cached_locked(self, key: str, ttl: int, loader, stale_ttl: int, negative_ttl: int | None, lock_timeout: int):
+        lock_key = f"{key}_lock"
+        lock_token = secrets.token_hex(16)
+
+        while not await self.set(lock_key, lock_token, nx=True, ex=lock_timeout):
+            await asyncio.sleep(0.05)
+
+            entry = decode_dict(await self.get(key))
+            if entry is not None and entry["e"] > time.time():
+                return entry["v"]
+
+        try:
+            start = time.monotonic()
+            value = await loader()
+            delta = time.monotonic() - start
+
+            if value is not None:
+                entry, ex = encode_cache_entry(value, ttl, stale_ttl, delta)
+            elif negative_ttl is not None:
+                entry, ex = encode_cache_entry(None, negative_ttl, 0, delta)
+            else:
+                return value
+
+            # The value is already computed, losing Redis now must not fail the caller
+            try:
+                await self.set(key, entry, ex=ex)
+            except RedisError:
+                self.fallback.put(key, value, self.fallback.generation)
+
+            return value
+        finally:
+            try:
+                await self.eval(RELEASE_LOCK_SCRIPT, 1, self._add_prefix(lock_key), lock_token)
+            except RedisError:
+                pass
 
 
 def create_connection() -> CustomRedisClient:
@@ -76,7 +524,8 @@ def create_connection() -> CustomRedisClient:
         key_prefix="probook", # custom prefix
         decode_responses=True,
         retry_on_timeout=True,
-        socket_keepalive=True
+        socket_keepalive=True,
+        socket_connect_timeout=CONNECT_TIMEOUT
     )
 
 
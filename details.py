@@ -29,4 +29,7 @@ START_TIME_GREATER_THAN_END = "The start date cannot be later than the end date"
 INVALID_UUID = "invalid UUID"
 WORKER_ALREADY_EXISTS = "Worker already exists"
 DATETIME_NOT_AVAILABLE = "datetime not available"
-IMAGE_NOT_EXISTS = "image not exists"
\ No newline at end of file
+IMAGE_NOT_EXISTS = "image not exists"
+SESSION_STORE_UNAVAILABLE = "Session store is unavailable"
+IMAGE_TOO_LARGE = "Image is too large"
+UNSUPPORTED_IMAGE_TYPE = "Unsupported image type, expected PNG, JPEG, GIF or WebP"
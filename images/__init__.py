@@ -0,0 +1,5 @@
+from .images import *
+from .static_files import *
+from .registry import *
+from .storage import *
+from .upload_limit import *
@@ -0,0 +1,296 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable
+from io import BytesIO
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import tempfile
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from config import config
+from .storage import get_image_storage
+
+# Local storage root, also the scratch directory for uploads with any storage backend
+STATIC_IMAGES_DIR = "./static/img"
+image_storage = get_image_storage(STATIC_IMAGES_DIR)
+PROCESS_WORKERS = int(config.get("Images", "process_workers", 2))
+MAX_UPLOAD_SIZE = int(config.get("Images", "max_upload_size", 10 * 1024 * 1024))
+# WebP copies served for `?w=`, `<name>_w<width>.webp` next to the original
+VARIANT_WIDTHS = tuple(sorted(config.get("Images", "variant_widths", [320, 640, 1280])))
+VARIANT_EXTENSION = ".webp"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# extension: (mime type, signature check on the first bytes)
+IMAGE_TYPES = {
+    ".png": ("image/png", lambda head: head.startswith(b"\x89PNG\r\n\x1a\n")),
+    ".jpeg": ("image/jpeg", lambda head: head.startswith(b"\xff\xd8\xff")),
+    ".gif": ("image/gif", lambda head: head[:6] in (b"GIF87a", b"GIF89a")),
+    ".webp": ("image/webp", lambda head: head[:4] == b"RIFF" and head[8:12] == b"WEBP"),
+}
+
+_process_pool: ProcessPoolExecutor | None = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=PROCESS_WORKERS)
+
+    return _process_pool
+
+
+def shutdown_process_pool():
+    global _process_pool
+
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+# Uploads live at `ab/cd/<sha256>.ext`, older ones at `<hmac>.ext` in the directory root
+CONTENT_ADDRESSED_NAME = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.(?:png|jpeg|gif|webp)$")
+
+
+# Any upload or its `?w=` variant, group 1 is the name without the extension and the variant suffix.
+# Profile photos (`<uuid>_<hash>.jpeg`) do not match, services.tmp_image_remover owns them
+UPLOAD_FILE_NAME = re.compile(r"^((?:[0-9a-f]{2}/[0-9a-f]{2}/)?[0-9a-f]{64})(?:_w\d+)?\.(?:png|jpeg|gif|webp)$")
+# An upload itself, the only files `?w=` variants are made of
+UPLOAD_ORIGINAL_NAME = re.compile(r"^(?:[0-9a-f]{2}/[0-9a-f]{2}/)?[0-9a-f]{64}\.(?:png|jpeg|gif|webp)$")
+
+
+def get_content_addressed_name(digest: str, extension: str) -> str:
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+
+class ImageTooLargeError(Exception):
+    pass
+
+
+class UnsupportedImageError(Exception):
+    pass
+
+
+def sniff_image_type(head: bytes) -> str | None:
+    """
+    Image extension from the magic bytes, the client's filename and content type are not trusted.
+    """
+
+    for extension, (_, matches) in IMAGE_TYPES.items():
+        if matches(head):
+            return extension
+
+    return None
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _write_chunk(buffer, digest, chunk: bytes):
+    digest.update(chunk)
+    buffer.write(chunk)
+
+
+async def save_upload(file, directory: str = STATIC_IMAGES_DIR, max_size: int = MAX_UPLOAD_SIZE) -> tuple[str, str, str]:
+    """
+    Stream an UploadFile in chunks to a temporary file in `directory`.
+
+    Returns the temporary path, the sniffed extension and the sha256 of the content.
+    The caller hands the file to store_upload.
+    """
+
+    if file.size is not None and file.size > max_size:
+        raise ImageTooLargeError()
+
+    fd, tmp_path = await asyncio.to_thread(tempfile.mkstemp, dir=directory, suffix=".tmp")
+    buffer = os.fdopen(fd, "wb")
+    digest = hashlib.sha256()
+
+    try:
+        size = 0
+        extension = None
+
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            if extension is None:
+                extension = sniff_image_type(chunk[:16])
+
+                if extension is None:
+                    raise UnsupportedImageError()
+
+            size += len(chunk)
+            if size > max_size:
+                raise ImageTooLargeError()
+
+            await asyncio.to_thread(_write_chunk, buffer, digest, chunk)
+
+        if extension is None:
+            raise UnsupportedImageError()
+
+        await asyncio.to_thread(buffer.close)
+
+    except BaseException:
+        await asyncio.to_thread(buffer.close)
+        await asyncio.to_thread(_remove_quietly, tmp_path)
+        raise
+
+    return tmp_path, extension, digest.hexdigest()
+
+
+async def discard_upload(tmp_path: str):
+    await asyncio.to_thread(_remove_quietly, tmp_path)
+
+
+async def store_upload(tmp_path: str, file_name: str, content_type: str) -> bool:
+    """
+    Move an upload and its WebP variants to image_storage under its content-addressed name.
+
+    Returns False when the same content was already stored. The original goes last,
+    so an existing file always comes with its variants.
+    """
+
+    variant_paths = {}
+
+    try:
+        if await image_storage.exists(file_name):
+            return False
+
+        try:
+            variant_paths = await run_in_process_pool(create_webp_variants, tmp_path, VARIANT_WIDTHS)
+        except Exception as e:
+            # Local files get them on first request, see ImageStaticFiles
+            logging.exception(e)
+
+        for width, variant_path in variant_paths.items():
+            await image_storage.store_file(get_variant_name(file_name, width), variant_path, IMAGE_TYPES[VARIANT_EXTENSION][0])
+
+        await image_storage.store_file(file_name, tmp_path, content_type)
+
+    finally:
+        for path in (tmp_path, *variant_paths.values()):
+            await asyncio.to_thread(_remove_quietly, path)
+
+    return True
+
+
+async def remove_image_file(file_name: str):
+    await image_storage.delete(file_name, *(get_variant_name(file_name, width) for width in VARIANT_WIDTHS))
+
+
+def get_variant_name(file_name: str, width: int) -> str:
+    stem, _ = os.path.splitext(file_name)
+    return f"{stem}_w{width}{VARIANT_EXTENSION}"
+
+
+def pick_variant_width(width: int) -> int:
+    """
+    The smallest variant at least `width` wide, the largest one for wider requests.
+    """
+
+    for variant_width in VARIANT_WIDTHS:
+        if variant_width >= width:
+            return variant_width
+
+    return VARIANT_WIDTHS[-1]
+
+
+def read_image_info(path: str) -> tuple[int, int, int]:
+    """
+    File size and dimensions, raises UnsupportedImageError when Pillow cannot read the file.
+
+    The magic bytes alone do not make an image, verify walks the file without decoding the pixels.
+    """
+
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            image.verify()
+    # Pillow reports broken chunks with SyntaxError
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError) as e:
+        raise UnsupportedImageError() from e
+
+    return os.path.getsize(path), width, height
+
+
+def read_display_width(path: str) -> int:
+    """
+    Width after the EXIF orientation is applied, as create_webp_variants sees it. Reads only the header.
+    """
+
+    with Image.open(path) as image:
+        # Orientations 5-8 swap the sides
+        if image.getexif().get(0x0112) in (5, 6, 7, 8):
+            return image.height
+
+        return image.width
+
+
+def create_webp_variants(path: str, widths: Iterable[int], quality: int = 80) -> dict[int, str]:
+    """
+    Write a WebP copy of the image at `path` for every width below the original one,
+    wider requests are served the original. Returns the paths by width.
+
+    Runs in the process pool, see run_in_process_pool.
+    """
+
+    stem, _ = os.path.splitext(path)
+    created = {}
+
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+
+        for width in widths:
+            if width >= image.width:
+                continue
+
+            variant = image.resize((width, round(image.height * width / image.width)), Image.Resampling.LANCZOS)
+
+            variant_path = f"{stem}_w{width}{VARIANT_EXTENSION}"
+            tmp_path = f"{variant_path}.tmp"
+
+            variant.save(tmp_path, format="WEBP", quality=quality)
+            os.replace(tmp_path, variant_path)
+
+            created[width] = variant_path
+
+    return created
+
+
+async def run_in_process_pool(func: Callable, *args):
+    """
+    Run CPU-heavy image work outside of the event loop.
+    """
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), func, *args)
+
+
+def resize_image(content: bytes, sizes: Iterable[int], format: str = "JPEG", quality: int = 85) -> dict[int, bytes]:
+    """
+    Decode an image and encode it once per size, fitting into a `size`x`size` box.
+
+    Runs in the process pool, see run_in_process_pool.
+    """
+
+    with Image.open(BytesIO(content)) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGB")
+
+        result = {}
+
+        for size in sizes:
+            variant = image.copy()
+            variant.thumbnail((size, size), Image.Resampling.LANCZOS)
+
+            buffer = BytesIO()
+            variant.save(buffer, format=format, quality=quality)
+            result[size] = buffer.getvalue()
+
+    return result
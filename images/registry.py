@@ -0,0 +1,67 @@
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models_ import image as image_db
+
+
+async def image_exists(file_name: str, session: AsyncSession) -> bool:
+    stmt = select(image_db.c.file_name).where(image_db.c.file_name == file_name)
+    return (await session.execute(stmt)).first() is not None
+
+
+async def register_image(
+        session: AsyncSession,
+        file_name: str,
+        hash: str,
+        size: int,
+        width: int,
+        height: int,
+        mime_type: str,
+        owner_uuid
+    ):
+    """
+    Record an upload, a repeated upload of the same content only increments `ref_count`.
+
+    Call it before the file is stored, the row stays locked until commit so
+    a concurrent release_image of the same content cannot remove the file meanwhile.
+    """
+
+    stmt = insert(image_db).values(
+        file_name=file_name,
+        hash=hash,
+        size=size,
+        width=width,
+        height=height,
+        mime_type=mime_type,
+        owner_uuid=owner_uuid,
+        ref_count=1
+    ).on_conflict_do_update(
+        index_elements=[image_db.c.file_name],
+        set_={"ref_count": image_db.c.ref_count + 1, "uploaded_at": func.now()}
+    )
+
+    await session.execute(stmt)
+
+
+async def release_image(file_name: str, session: AsyncSession) -> int | None:
+    """
+    Drop one upload of an image, returns how many are left or None when the image is unknown.
+
+    The row is deleted with the last upload and stays locked until commit, the caller
+    removes the file before committing so a concurrent upload waits and stores it again.
+    """
+
+    stmt = update(image_db).where(
+        image_db.c.file_name == file_name
+    ).values(
+        ref_count=image_db.c.ref_count - 1
+    ).returning(image_db.c.ref_count)
+
+    ref_count = (await session.execute(stmt)).scalar()
+
+    if ref_count is not None and ref_count <= 0:
+        await session.execute(delete(image_db).where(image_db.c.file_name == file_name))
+        ref_count = 0
+
+    return ref_count
@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import os
+import re
+import stat
+from mimetypes import guess_type
+
+import anyio
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers, QueryParams
+from starlette.responses import FileResponse, RedirectResponse
+from starlette.staticfiles import NotModifiedResponse
+
+from database.local_cache import LocalCache
+from .images import (
+    image_storage,
+    UPLOAD_ORIGINAL_NAME,
+    VARIANT_WIDTHS,
+    read_display_width,
+    get_variant_name,
+    pick_variant_width,
+    create_webp_variants,
+    run_in_process_pool
+)
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+# Names that embed a hash of their content: uploads (and their `?w=` variants) and profile photos
+HASHED_NAMES = (
+    re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64}(?:_w\d+)?)\.[a-z]+$"),
+    re.compile(r"^([0-9a-f-]{36}_[0-9a-f]{16}(?:_\d+)?)\.jpeg$"),
+)
+
+# `<name>.br` / `<name>.gz` next to a file are served instead of it when the client accepts them
+PRECOMPRESSED_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+# Variants generated on demand for images uploaded before they existed
+_variant_tasks: dict[str, asyncio.Task] = {}
+
+# With a remote image_storage: whether a variant was stored, none is for widths at or above the original
+_remote_variants = LocalCache(10000, 3600)
+_remote_variants.active = True
+
+
+def get_hashed_name(name: str) -> str | None:
+    for pattern in HASHED_NAMES:
+        match = pattern.match(name)
+
+        if match is not None:
+            return match[1]
+
+    return None
+
+
+def get_accepted_encodings(headers: Headers) -> set[str]:
+    encodings = set()
+
+    for part in headers.get("accept-encoding", "").split(","):
+        encoding, _, params = part.partition(";")
+
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+
+        encodings.add(encoding.strip().lower())
+
+    return encodings
+
+
+class ImageFileResponse(FileResponse):
+    """
+    FileResponse with the strong ETag chosen by ImageStaticFiles instead of the mtime/size hash.
+    """
+
+    def __init__(self, path, stat_result: os.stat_result, etag: str, **kwargs):
+        self.etag = etag
+
+        super().__init__(path, stat_result=stat_result, **kwargs)
+
+    def set_stat_headers(self, stat_result: os.stat_result):
+        self.headers.setdefault("etag", self.etag)
+        super().set_stat_headers(stat_result)
+
+
+class ImageStaticFiles(StaticFiles):
+    """
+    Hashed names never change under their name, so browsers and proxies may keep them for good,
+    everything else is revalidated with a strong ETag.
+
+    `?w=<width>` serves the nearest WebP variant instead of the original.
+    Range and HEAD requests are handled by FileResponse without reading the whole file.
+
+    With a remote image_storage the files are not on this node, clients are redirected to them.
+    """
+
+    def file_response(
+        self,
+        full_path,
+        stat_result,
+        scope,
+        status_code=200,
+        name: str | None = None,
+        headers: dict[str, str] | None = None,
+        media_type: str | None = None
+    ):
+        if name is None:
+            name = self.get_path(scope)
+
+        name = name.replace(os.sep, "/")
+        hashed_name = get_hashed_name(name)
+        encoding = (headers or {}).get("Content-Encoding")
+
+        if hashed_name is not None:
+            etag = f'"{hashed_name}-{encoding}"' if encoding else f'"{hashed_name}"'
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        else:
+            etag = f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+            cache_control = REVALIDATE_CACHE_CONTROL
+
+        response = ImageFileResponse(
+            full_path,
+            stat_result,
+            etag,
+            status_code=status_code,
+            headers={"Cache-Control": cache_control, "Vary": "Accept-Encoding", **(headers or {})},
+            media_type=media_type
+        )
+
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+
+        return response
+
+    def is_not_modified(self, response_headers, request_headers) -> bool:
+        # If-None-Match takes precedence over If-Modified-Since when both are sent
+        if_none_match = request_headers.get("if-none-match")
+
+        if if_none_match is None:
+            return super().is_not_modified(response_headers, request_headers)
+
+        if if_none_match.strip() == "*":
+            return True
+
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return response_headers["etag"] in tags
+
+    async def get_response(self, path: str, scope):
+        if scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+
+        width = QueryParams(scope["query_string"]).get("w")
+        has_variants = width is not None and width.isdigit() and UPLOAD_ORIGINAL_NAME.match(path.replace(os.sep, "/"))
+
+        if not image_storage.is_local:
+            if has_variants:
+                path = await self.get_remote_variant_name(path, int(width))
+
+            return await self.get_redirect_response(path)
+
+        if has_variants:
+            response = await self.get_variant_response(path, int(width), scope)
+
+            if response is not None:
+                return response
+
+        response = await self.get_precompressed_response(path, scope)
+
+        if response is not None:
+            return response
+
+        return await super().get_response(path, scope)
+
+    async def get_remote_variant_name(self, path: str, width: int) -> str:
+        variant_path = get_variant_name(path.replace(os.sep, "/"), pick_variant_width(width))
+
+        hit, exists = _remote_variants.get(variant_path)
+        if not hit:
+            exists = await image_storage.exists(variant_path)
+            _remote_variants.put(variant_path, exists, _remote_variants.generation)
+
+        return variant_path if exists else path
+
+    async def get_redirect_response(self, path: str):
+        name = path.replace(os.sep, "/")
+        url = await image_storage.get_url(name)
+
+        if image_storage.url_expires is not None:
+            cache_control = f"private, max-age={image_storage.url_expires // 2}"
+        elif get_hashed_name(name) is not None:
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        else:
+            cache_control = REVALIDATE_CACHE_CONTROL
+
+        return RedirectResponse(url, status_code=302, headers={"Cache-Control": cache_control})
+
+    async def get_precompressed_response(self, path: str, scope):
+        accepted = get_accepted_encodings(Headers(scope=scope))
+
+        for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+            if encoding not in accepted:
+                continue
+
+            full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+
+            if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+                return self.file_response(
+                    full_path,
+                    stat_result,
+                    scope,
+                    name=path,
+                    headers={"Content-Encoding": encoding},
+                    media_type=guess_type(path)[0] or "application/octet-stream"
+                )
+
+        return None
+
+    async def get_variant_response(self, path: str, width: int, scope):
+        """
+        The variant for `width`, None when the original is to be served.
+        """
+
+        variant_width = pick_variant_width(width)
+        variant_path = get_variant_name(path, variant_width)
+        full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, variant_path)
+
+        if stat_result is None:
+            original_path, original_stat = await anyio.to_thread.run_sync(self.lookup_path, path)
+
+            if original_stat is None or not stat.S_ISREG(original_stat.st_mode):
+                return None
+
+            try:
+                # No variant is made at or above the original width
+                if await anyio.to_thread.run_sync(read_display_width, original_path) <= variant_width:
+                    return None
+
+                await self.create_variants(original_path)
+            except Exception as e:
+                logging.exception(e)
+                return None
+
+            full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, variant_path)
+
+        if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+            return None
+
+        return self.file_response(full_path, stat_result, scope, name=variant_path)
+
+    async def create_variants(self, original_path: str):
+        task = _variant_tasks.get(original_path)
+
+        if task is None:
+            task = asyncio.ensure_future(run_in_process_pool(create_webp_variants, original_path, VARIANT_WIDTHS))
+            _variant_tasks[original_path] = task
+            task.add_done_callback(lambda _: _variant_tasks.pop(original_path, None))
+
+        await asyncio.shield(task)
@@ -0,0 +1,450 @@
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import AsyncIterator, NamedTuple
+from urllib.parse import quote
+from xml.etree import ElementTree
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+
+import httpx
+
+from config import config
+
+STORAGE_BACKEND = config["Storage"]["backend"]
+
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+# S3 rejects multipart parts below 5 MiB except the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class StoredFile(NamedTuple):
+    name: str
+    size: int
+    modified: datetime
+
+
+class ImageStorage(ABC):
+    """
+    Where image files live, names are paths relative to the storage root (`ab/cd/<sha256>.png`).
+    """
+
+    is_local = False
+    # Seconds the URLs of get_url stay valid, None when they do not expire
+    url_expires: int | None = None
+
+    async def setup(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def exists(self, name: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def store_file(self, name: str, path: str, content_type: str):
+        """
+        Move a local file under `name`, the file at `path` is gone afterwards.
+        """
+
+    @abstractmethod
+    async def put_bytes(self, name: str, content: bytes, content_type: str):
+        pass
+
+    @abstractmethod
+    async def delete(self, *names: str):
+        """
+        Remove files, missing ones are ignored.
+        """
+
+    @abstractmethod
+    async def get_url(self, name: str) -> str:
+        """
+        URL clients are redirected to, see ImageStaticFiles.
+        """
+
+    @abstractmethod
+    def iterate_files(self, page_size: int = 1000) -> AsyncIterator[list[StoredFile]]:
+        """
+        Every stored file, in pages of at most `page_size`.
+        """
+
+
+def encode_query(query: dict[str, str]) -> str:
+    return "&".join(f"{quote(key, safe='-_.~')}={quote(value, safe='-_.~')}" for key, value in sorted(query.items()))
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _move_file(path: str, target: str):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(path, target)
+
+
+def _write_file(target: str, content: bytes):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.tmp"
+
+    with open(tmp_path, "wb") as buffer:
+        buffer.write(content)
+
+    os.replace(tmp_path, target)
+
+
+def _list_files(directory: str, root: str, recursive: bool) -> list[StoredFile]:
+    files = []
+
+    for dir_path, dir_names, file_names in os.walk(directory):
+        if not recursive:
+            dir_names.clear()
+
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+
+            try:
+                stat_result = os.stat(path)
+            except FileNotFoundError:
+                continue
+
+            files.append(StoredFile(
+                os.path.relpath(path, root).replace(os.sep, "/"),
+                stat_result.st_size,
+                datetime.fromtimestamp(stat_result.st_mtime, timezone.utc)
+            ))
+
+    return files
+
+
+def _list_directories(directory: str) -> list[str]:
+    with os.scandir(directory) as entries:
+        return sorted(entry.name for entry in entries if entry.is_dir())
+
+
+def _read_part(path: str, offset: int, size: int) -> bytes:
+    with open(path, "rb") as file:
+        file.seek(offset)
+        return file.read(size)
+
+
+class LocalImageStorage(ImageStorage):
+    """
+    Files in a local directory served by ImageStaticFiles, one API node only.
+    """
+
+    is_local = True
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def get_path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    async def setup(self):
+        await asyncio.to_thread(os.makedirs, self.directory, exist_ok=True)
+
+    async def exists(self, name: str) -> bool:
+        return await asyncio.to_thread(os.path.exists, self.get_path(name))
+
+    async def store_file(self, name: str, path: str, content_type: str):
+        await asyncio.to_thread(_move_file, path, self.get_path(name))
+
+    async def put_bytes(self, name: str, content: bytes, content_type: str):
+        await asyncio.to_thread(_write_file, self.get_path(name), content)
+
+    async def delete(self, *names: str):
+        for name in names:
+            await asyncio.to_thread(_remove_quietly, self.get_path(name))
+
+    async def get_url(self, name: str) -> str:
+        return f"/api/static/{quote(name)}"
+
+    async def iterate_files(self, page_size: int = 1000) -> AsyncIterator[list[StoredFile]]:
+        # One subdirectory (`ab/`) at a time, so the whole tree is never listed at once
+        directories = await asyncio.to_thread(_list_directories, self.directory)
+
+        files = await asyncio.to_thread(_list_files, self.directory, self.directory, False)
+
+        for directory in [None, *directories]:
+            if directory is not None:
+                files = await asyncio.to_thread(_list_files, self.get_path(directory), self.directory, True)
+
+            for i in range(0, len(files), page_size):
+                yield files[i:i + page_size]
+
+
+class S3ImageStorage(ImageStorage):
+    """
+    Bucket of an S3-compatible service (AWS S3, MinIO, ...) shared by all API nodes.
+
+    Requests are signed with AWS Signature Version 4 and use path-style URLs,
+    clients are redirected to `public_url` when set, to presigned URLs otherwise.
+    """
+
+    def __init__(
+        self,
+        endpoint_url: str,
+        bucket: str,
+        region: str,
+        access_key: str,
+        secret_key: str,
+        public_url: str = "",
+        url_ttl: int = 3600,
+        part_size: int = 8 * 1024 * 1024
+    ):
+        self.endpoint_url = endpoint_url.rstrip("/")
+        self.bucket = bucket
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.public_url = public_url.rstrip("/")
+        self.url_ttl = url_ttl
+        self.part_size = max(part_size, MIN_PART_SIZE)
+
+        self.url_expires = None if self.public_url else url_ttl
+
+        self.host = httpx.URL(self.endpoint_url).netloc.decode()
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=30)
+
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def get_object_path(self, name: str = "") -> str:
+        path = f"/{self.bucket}"
+
+        if name:
+            path += f"/{name}"
+
+        return quote(path, safe="/-_.~")
+
+    def get_signing_key(self, date: str) -> bytes:
+        key = f"AWS4{self.secret_key}".encode()
+
+        for part in (date, self.region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+
+        return key
+
+    def get_signature(
+        self,
+        method: str,
+        path: str,
+        query: dict[str, str],
+        headers: dict[str, str],
+        payload_hash: str,
+        now: datetime
+    ) -> tuple[str, str]:
+        """
+        Returns the signed header names and the signature of a request, `headers` must include host.
+        """
+
+        date = now.strftime("%Y%m%d")
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+
+        canonical_headers = {key.lower(): " ".join(str(value).split()) for key, value in headers.items()}
+        signed_headers = ";".join(sorted(canonical_headers))
+
+        canonical_request = "\n".join([
+            method,
+            path,
+            encode_query(query),
+            "".join(f"{key}:{canonical_headers[key]}\n" for key in sorted(canonical_headers)),
+            signed_headers,
+            payload_hash
+        ])
+
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            f"{date}/{self.region}/s3/aws4_request",
+            hashlib.sha256(canonical_request.encode()).hexdigest()
+        ])
+
+        signature = hmac.new(self.get_signing_key(date), string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+        return signed_headers, signature
+
+    async def request(
+        self,
+        method: str,
+        name: str = "",
+        query: dict[str, str] | None = None,
+        headers: dict[str, str] | None = None,
+        content: bytes = b""
+    ) -> httpx.Response:
+        query = query or {}
+        now = datetime.now(timezone.utc)
+        payload_hash = hashlib.sha256(content).hexdigest()
+
+        headers = {
+            "host": self.host,
+            "x-amz-date": now.strftime("%Y%m%dT%H%M%SZ"),
+            "x-amz-content-sha256": payload_hash,
+            **(headers or {})
+        }
+
+        path = self.get_object_path(name)
+        signed_headers, signature = self.get_signature(method, path, query, headers, payload_hash, now)
+
+        headers["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{now.strftime('%Y%m%d')}/{self.region}/s3/aws4_request, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        del headers["host"]
+
+        url = f"{self.endpoint_url}{path}"
+        if query:
+            url += f"?{encode_query(query)}"
+
+        response = await self.client.request(method, url, headers=headers, content=content)
+
+        if response.status_code >= 400 and not (method in ("HEAD", "DELETE") and response.status_code == 404):
+            response.raise_for_status()
+
+        return response
+
+    async def setup(self):
+        response = await self.request("HEAD")
+
+        if response.status_code == 404:
+            await self.request("PUT")
+
+    async def exists(self, name: str) -> bool:
+        response = await self.request("HEAD", name)
+        return response.status_code == 200
+
+    async def put_bytes(self, name: str, content: bytes, content_type: str):
+        await self.request("PUT", name, headers={"content-type": content_type}, content=content)
+
+    async def store_file(self, name: str, path: str, content_type: str):
+        size = await asyncio.to_thread(os.path.getsize, path)
+
+        if size <= self.part_size:
+            content = await asyncio.to_thread(_read_part, path, 0, size)
+            await self.put_bytes(name, content, content_type)
+        else:
+            await self.upload_multipart(name, path, size, content_type)
+
+        await asyncio.to_thread(_remove_quietly, path)
+
+    async def upload_multipart(self, name: str, path: str, size: int, content_type: str):
+        """
+        Send a large file in `part_size` parts, only one part is held in memory at a time.
+        """
+
+        response = await self.request("POST", name, query={"uploads": ""}, headers={"content-type": content_type})
+        upload_id = ElementTree.fromstring(response.content).findtext("{*}UploadId")
+
+        try:
+            parts = []
+
+            for number, offset in enumerate(range(0, size, self.part_size), start=1):
+                content = await asyncio.to_thread(_read_part, path, offset, self.part_size)
+                response = await self.request(
+                    "PUT", name,
+                    query={"partNumber": str(number), "uploadId": upload_id},
+                    content=content
+                )
+                parts.append((number, response.headers["etag"]))
+
+            body = "".join(
+                f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in parts
+            )
+            await self.request(
+                "POST", name,
+                query={"uploadId": upload_id},
+                content=f"<CompleteMultipartUpload>{body}</CompleteMultipartUpload>".encode()
+            )
+
+        except BaseException:
+            # A failed abort must not hide why the upload failed, parts left behind only cost storage
+            try:
+                await self.request("DELETE", name, query={"uploadId": upload_id})
+            except Exception as e:
+                logging.warning(f"Could not abort multipart upload {upload_id} of {name}: {e}")
+
+            raise
+
+    async def delete(self, *names: str):
+        await asyncio.gather(*(self.request("DELETE", name) for name in names))
+
+    async def iterate_files(self, page_size: int = 1000) -> AsyncIterator[list[StoredFile]]:
+        query = {"list-type": "2", "max-keys": str(page_size)}
+
+        while True:
+            response = await self.request("GET", query=query)
+            result = ElementTree.fromstring(response.content)
+
+            files = [
+                StoredFile(
+                    item.findtext("{*}Key"),
+                    int(item.findtext("{*}Size")),
+                    datetime.fromisoformat(item.findtext("{*}LastModified").replace("Z", "+00:00"))
+                )
+                for item in result.iterfind("{*}Contents")
+            ]
+
+            if files:
+                yield files
+
+            token = result.findtext("{*}NextContinuationToken")
+            if result.findtext("{*}IsTruncated") != "true" or not token:
+                break
+
+            query["continuation-token"] = token
+
+    def get_presigned_url(self, name: str, expires: int, now: datetime | None = None) -> str:
+        now = now or datetime.now(timezone.utc)
+        path = self.get_object_path(name)
+
+        query = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key}/{now.strftime('%Y%m%d')}/{self.region}/s3/aws4_request",
+            "X-Amz-Date": now.strftime("%Y%m%dT%H%M%SZ"),
+            "X-Amz-Expires": str(expires),
+            "X-Amz-SignedHeaders": "host",
+        }
+
+        _, signature = self.get_signature("GET", path, query, {"host": self.host}, UNSIGNED_PAYLOAD, now)
+        query["X-Amz-Signature"] = signature
+
+        return f"{self.endpoint_url}{path}?{encode_query(query)}"
+
+    async def get_url(self, name: str) -> str:
+        if self.public_url:
+            return f"{self.public_url}/{quote(name)}"
+
+        return self.get_presigned_url(name, self.url_ttl)
+
+
+def get_image_storage(local_directory: str) -> ImageStorage:
+    if STORAGE_BACKEND == "s3":
+        return S3ImageStorage(
+            endpoint_url=config["Storage"]["endpoint_url"],
+            bucket=config["Storage"]["bucket"],
+            region=config["Storage"]["region"],
+            access_key=config["Storage"]["access_key"],
+            secret_key=config["Storage"]["secret_key"],
+            public_url=config["Storage"]["public_url"],
+            url_ttl=int(config.get("Storage", "url_ttl", 3600)),
+            part_size=int(config.get("Storage", "part_size", 8 * 1024 * 1024))
+        )
+
+    return LocalImageStorage(local_directory)
@@ -0,0 +1,53 @@
+from fastapi import HTTPException
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from details import IMAGE_TOO_LARGE
+from .images import MAX_UPLOAD_SIZE
+
+# Room for the multipart boundaries and part headers around the file
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Stop image uploads over MAX_UPLOAD_SIZE while they are received.
+
+    Starlette spools the whole multipart body before the endpoint runs, so save_upload
+    alone would only reject it after the fact. Bodies are checked by Content-Length
+    and by the bytes actually received, save_upload still checks the exact file size.
+    """
+
+    def __init__(self, app: ASGIApp, path: str, max_size: int = MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD):
+        self.app = app
+        self.path = path.rstrip("/")
+        self.max_size = max_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"].rstrip("/") != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length", "")
+
+        if content_length.isdigit() and int(content_length) > self.max_size:
+            await JSONResponse({"detail": IMAGE_TOO_LARGE}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+
+            message = await receive()
+
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+
+                if received > self.max_size:
+                    raise HTTPException(status_code=413, detail=IMAGE_TOO_LARGE)
+
+            return message
+
+        await self.app(scope, limited_receive, send)
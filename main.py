@@ -1,6 +1,5 @@
 from fastapi import FastAPI, Depends, Request, HTTPException, APIRouter
 from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import json
@@ -15,7 +14,7 @@ from routers.event import router as event_router
 from routers.coworking import router as coworking_router
 from routers.permissions import router as permissions_router
 from routers.item import router as items_router
-from routers.uploader import router as uploader_router, STATIC_IMAGES_DIR
+from routers.uploader import router as uploader_router
 from routers.schedule import router as schedule_router
 from routers.room import router as room_router
 from routers.action_history import router as action_history_router
@@ -29,17 +28,26 @@ from sqlalchemy import (
 from database import async_session_maker
 from mock_data import schedule_template
 from models_ import schedule, room as room_db
-from services import subscribe_expired_keys, repeat_event_updater
-from services.tmp_image_remover import pubsub
+from services import tmp_image_remover, repeat_event_updater, action_history_writer, action_history_archiver, profile_photo_fetcher, directory_sync, token_refresher, cache_invalidation_listener, image_gc
+from images import shutdown_process_pool, ImageStaticFiles, UploadSizeLimitMiddleware, image_storage, STATIC_IMAGES_DIR
 from shared.utils.schedule_utils import schedule_template_fix
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup code
-    app.state.expired_keys_task = asyncio.create_task(subscribe_expired_keys())
+    await image_storage.setup()
+
+    app.state.tmp_image_remover_task = asyncio.create_task(tmp_image_remover())
 
     asyncio.create_task(repeat_event_updater())
+    asyncio.create_task(action_history_writer())
+    asyncio.create_task(action_history_archiver())
+    asyncio.create_task(profile_photo_fetcher())
+    asyncio.create_task(directory_sync())
+    asyncio.create_task(token_refresher())
+    asyncio.create_task(cache_invalidation_listener())
+    asyncio.create_task(image_gc())
 
     async with async_session_maker() as session:
         await schedule_template_fix(session)
@@ -48,7 +56,7 @@ async def lifespan(app: FastAPI):
     yield
     
     # Shutdown code
-    task = app.state.expired_keys_task
+    task = app.state.tmp_image_remover_task
     task.cancel()
 
     try:
@@ -56,11 +64,9 @@ async def lifespan(app: FastAPI):
     except asyncio.CancelledError:
         logging.info("Background task cancelled")
 
-    if pubsub:
-        await pubsub.unsubscribe('__keyevent@0__:expired')
-        await pubsub.close()
-    
     await redis_db.close()
+    await image_storage.close()
+    shutdown_process_pool()
 
 
 app = FastAPI(
@@ -72,7 +78,7 @@ app = FastAPI(
 )
 
 os.makedirs(STATIC_IMAGES_DIR, exist_ok=True)
-app.mount("/api/static", StaticFiles(directory=STATIC_IMAGES_DIR), name="static")
+app.mount("/api/static", ImageStaticFiles(directory=STATIC_IMAGES_DIR), name="static")
 api_router = APIRouter(
     prefix="/api"
 )
@@ -95,12 +101,17 @@ for router in routers:
     api_router.include_router(router)
 
 
+# Inside the middleware below, its receive would turn the 413 raised while reading into a 400
+app.add_middleware(UploadSizeLimitMiddleware, path="/api/img")
+
+
 async def add_new_token_to_response(request: Request, call_next):
     response = await call_next(request)
 
     user = getattr(request.state, "__auth_user_data", None)
 
-    if user:
+    # Streamed responses carry the token themselves and are not buffered here
+    if user and not getattr(request.state, "__token_in_body", False):
         response_body = [chunk async for chunk in response.body_iterator]
         content_dict = json.loads(b"".join(response_body).decode("utf-8"))
 
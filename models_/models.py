@@ -16,7 +16,10 @@ from sqlalchemy import (
     TEXT,
     DATE,
     JSON,
+    Index,
+    func,
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from datetime import datetime
 meta_data = MetaData()
 
@@ -45,7 +48,14 @@ user = Table(
     Column("uuid", UUID, nullable=False, index=True, primary_key=True),
     Column("name", String),
     Column("is_superuser", Boolean, server_default="false", nullable=False),
-    Column("group_id", ForeignKey("group.id"), nullable=True, index=True)
+    Column("group_id", ForeignKey("group.id"), nullable=True, index=True),
+
+    Index(
+        "ix_user_name_trgm",
+        "name",
+        postgresql_using="gin",
+        postgresql_ops={"name": "gin_trgm_ops"}
+    ),
 )
 
 
@@ -113,17 +123,48 @@ schedule = Table(
 action_history = Table(
     "action_history",
     meta_data,
-    Column("id", Integer, primary_key=True),
+    Column("id", Integer, primary_key=True, autoincrement=True),
     Column("action", String, nullable=False, index=True),
-    Column("date", TIMESTAMP, nullable=False, default=datetime.utcnow, index=True),
+    Column("date", TIMESTAMP, nullable=False, default=datetime.utcnow, index=True, primary_key=True),
     Column("subject_uuid", ForeignKey("user.uuid"), nullable=False),
     Column("object_table", String, nullable=False),
     Column("object_id", String, nullable=False),
-    Column("detail", JSON, nullable=False),
+    Column("detail", JSONB, nullable=False),
+
+    Index(
+        "ix_action_history_detail",
+        "detail",
+        postgresql_using="gin",
+        postgresql_ops={"detail": "jsonb_path_ops"}
+    ),
+
+    postgresql_partition_by="RANGE (date)", # monthly partitions, see services.action_history_archiver
+)
+
+Index(
+    "ix_action_history_object",
+    action_history.c.object_table,
+    action_history.c.object_id,
+    action_history.c.date.desc()
 )
 
 worker = Table(
     "worker",
     meta_data,
     Column("user_uuid", ForeignKey("user.uuid"), nullable=False, primary_key=True)
-)
\ No newline at end of file
+)
+
+image = Table(
+    "image",
+    meta_data,
+    Column("file_name", String, primary_key=True), # path relative to images.STATIC_IMAGES_DIR
+    Column("hash", String(64), nullable=True, index=True),
+    Column("size", Integer, nullable=True),
+    Column("width", Integer, nullable=True),
+    Column("height", Integer, nullable=True),
+    Column("mime_type", String, nullable=True),
+    Column("owner_uuid", ForeignKey("user.uuid"), nullable=True, index=True),
+    Column("ref_count", Integer, nullable=False, server_default="1"), # uploads sharing the file
+    Column("created_at", TIMESTAMP, nullable=False, server_default=func.now()),
+    Column("uploaded_at", TIMESTAMP, nullable=False, server_default=func.now()) # latest upload, see services.image_gc
+)
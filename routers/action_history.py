@@ -6,12 +6,17 @@ from models_ import action_history as action_history_db
 from permissions import get_depend_user_with_perms, Permissions
 
 from fastapi import APIRouter, HTTPException, Request, Depends, Body, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 from httpx_oauth.oauth2 import RefreshTokenError, GetAccessTokenError
 from sqlalchemy import update, select, insert, delete, func
+from database import json_loads, json_dumps_bytes, async_session_maker
+from action_history import get_hot_boundary, apply_action_to_state
 import math
 
+DETAIL_FILTER_PREFIX = "detail."
+
 router = APIRouter(
     prefix="/history",
     tags=["history"]
@@ -20,11 +25,16 @@ router = APIRouter(
 @router.get('/{id}', response_model=ActionHistoryRead)
 async def get_action(
         id: int,
+        include_cold: bool = False,
         user: UserToken = Depends(get_depend_user_with_perms([Permissions.action_history_view.value])),
         session: AsyncSession = Depends(get_async_session)
     ):
 
     select_statement = action_history_db.select().where(action_history_db.c.id == id)
+
+    if not include_cold:
+        select_statement = select_statement.where(action_history_db.c.date >= get_hot_boundary())
+
     row = await session.execute(select_statement)
     row = row.fetchone()
 
@@ -37,14 +47,51 @@ async def get_action(
     
     return result
 
+def get_detail_filter(request: Request) -> dict:
+    """
+    Collect `detail.<key>=<value>` query params into a JSONB containment document.
+
+    Nested keys are dotted (`detail.new.room_id=5`), values are parsed as JSON
+    when possible so `5` matches a number and `abc` a string.
+    """
+
+    detail_filter = {}
+
+    for key, value in request.query_params.items():
+        if not key.startswith(DETAIL_FILTER_PREFIX):
+            continue
+
+        path = key[len(DETAIL_FILTER_PREFIX):].split(".")
+        if not all(path):
+            continue
+
+        try:
+            value = json_loads(value)
+        except ValueError:
+            pass
+
+        node = detail_filter
+        for part in path[:-1]:
+            node = node.setdefault(part, {})
+
+            if not isinstance(node, dict):
+                break
+        else:
+            node[path[-1]] = value
+
+    return detail_filter
+
+
 @router.get('/', response_model=BaseTokenPageResponse[list[ActionHistoryRead]])
 async def get_all_actions(
+        request: Request,
         action: str | None = None,
         date_start: datetime | None = None,
         date_end: datetime | None = None,
         subject_uuid: uuid.UUID | None = None,
         object_table: str | None = None,
         object_id: int | str | None = None,
+        include_cold: bool = False,
         limit: int = 10,
         page: int = 1,
         user: UserToken = Depends(get_depend_user_with_perms([Permissions.action_history_view.value])),
@@ -59,9 +106,14 @@ async def get_all_actions(
     limit = min(max(1, limit), 60)
     page = max(1, page) - 1
     
-    select_statement = action_history_db.select().limit(limit).offset(page * limit)
+    select_statement = action_history_db.select().order_by(action_history_db.c.date.desc()).limit(limit).offset(page * limit)
     total_pages_stmt = select(func.count(action_history_db.c.id))
 
+    # Partitions older than the hot window are pruned from the scan
+    if not include_cold:
+        select_statement = select_statement.where(action_history_db.c.date >= get_hot_boundary())
+        total_pages_stmt = total_pages_stmt.where(action_history_db.c.date >= get_hot_boundary())
+
     if action is not None:
         select_statement = select_statement.where(action_history_db.c.action == action)
         total_pages_stmt = total_pages_stmt.where(action_history_db.c.action == action)
@@ -88,6 +140,12 @@ async def get_all_actions(
         select_statement = select_statement.where(action_history_db.c.object_id == object_id)
         total_pages_stmt = total_pages_stmt.where(action_history_db.c.object_id == object_id)
 
+    detail_filter = get_detail_filter(request)
+
+    if detail_filter:
+        select_statement = select_statement.where(action_history_db.c.detail.contains(detail_filter))
+        total_pages_stmt = total_pages_stmt.where(action_history_db.c.detail.contains(detail_filter))
+
     rows = await session.execute(select_statement)
     rows = rows.fetchall()
 
@@ -108,4 +166,59 @@ async def get_all_actions(
         result=result,
         current_page=current_page,
         total_page=total_pages
-    )
\ No newline at end of file
+    )
+
+
+async def stream_timeline(select_statement, reconstruct: bool, new_token: str | None):
+    # The request session is closed before the body is sent, so the cursor gets its own
+    async with async_session_maker() as session:
+        result = await session.stream(select_statement)
+
+        state = None
+        separator = b""
+
+        # BaseTokenResponse written by hand, add_new_token_to_response leaves streamed bodies alone
+        yield b'{"new_token":' + json_dumps_bytes(new_token) + b',"result":['
+
+        async for row in result.mappings():
+            item = ActionHistoryTimelineRead(**row)
+
+            if reconstruct:
+                state = apply_action_to_state(state, item.action, row["detail"])
+                item.state = state
+
+            yield separator + item.model_dump_json().encode()
+            separator = b","
+
+        yield b"]}"
+
+
+@router.get('/{object_table}/{object_id}', response_model=BaseTokenResponse[list[ActionHistoryTimelineRead]])
+async def get_object_timeline(
+        request: Request,
+        object_table: str,
+        object_id: str,
+        reconstruct: bool = False,
+        include_cold: bool = False,
+        user: UserToken = Depends(get_depend_user_with_perms([Permissions.action_history_view.value])),
+    ):
+    """
+    Ordered history of one object, oldest first, served by ix_action_history_object.
+
+    With `reconstruct=true` every entry carries the object state after that action.
+    """
+
+    select_statement = action_history_db.select().where(
+        action_history_db.c.object_table == object_table,
+        action_history_db.c.object_id == object_id
+    ).order_by(action_history_db.c.date)
+
+    if not include_cold:
+        select_statement = select_statement.where(action_history_db.c.date >= get_hot_boundary())
+
+    request.state.__token_in_body = True
+
+    return StreamingResponse(
+        stream_timeline(select_statement, reconstruct, user.new_token),
+        media_type="application/json"
+    )
@@ -3,17 +3,22 @@ from config import config
 from schemas import *
 from database import redis_db, get_async_session
 from auth import *
-from .uploader import upload as upload_file
-from auth.auth import get_user_by_uuid as get_user_by_uuid_db, get_user_image_path, get_microsoft_user_info
+from auth.graph import GRAPH_URL
+from auth.auth import get_user_by_uuid as get_user_by_uuid_db, get_user_image_path, get_microsoft_user_info, select_users_with_group, read_users_microsoft
+from auth.auth import MICROSOFT_INFO_TTL, MICROSOFT_INFO_STALE_TTL, get_microsoft_info_cache_key
+from auth.profile_photo import PHOTO_FRESH_TTL, PHOTO_RETENTION_TTL, get_photo_cache_key, enqueue_profile_photo
+from auth.workers_cache import reset_workers_cache
 from models_ import user as user_db
 
-from fastapi import APIRouter, HTTPException, Request, Depends, Body, status, UploadFile
+from fastapi import APIRouter, HTTPException, Request, Depends, Body, status, UploadFile, Query
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import func
 from httpx_oauth.oauth2 import RefreshTokenError, GetAccessTokenError
+from redis.exceptions import RedisError
 import math
-import io
+
+USER_SEARCH_MIN_LENGTH = 3 # shorter queries have no trigrams to use ix_user_name_trgm
 
 router = APIRouter(
     prefix="/auth",
@@ -74,74 +79,77 @@ async def get_microsoft_me(user: UserToken, session: AsyncSession):
     Fetch the current user's information from Microsoft Graph API.
     """
 
-    prefix = 'info:'
-    user_redis_temp = await redis_db.get(f"{prefix}{user.uuid}_temp")
+    user_uuid = user.uuid
+    microsoft_access_token = user.microsoft_access_token
 
-    if user_redis_temp is not None:
-        user_redis = await redis_db.get_dict(f"{prefix}{user.uuid}")
+    async def load_microsoft_me():
+        async with microsoft_oauth_client.get_httpx_client() as client:
+            user_info_response = await client.get(
+                f"{GRAPH_URL}/me",
+                headers={"Authorization": f"Bearer {microsoft_access_token}"}
+            )
 
-        if user_redis is not None:
-            return user_redis
+        if user_info_response.status_code != 200:
+            raise HTTPException(status_code=user_info_response.status_code, detail=FAILED_FETCH_USER_INFO)
 
-    async with microsoft_oauth_client.get_httpx_client() as client:
-        user_info_response = await client.get(
-            "https://graph.microsoft.com/v1.0/me",
-            headers={"Authorization": f"Bearer {user.microsoft_access_token}"}
-        )
+        microsoft_data = user_info_response.json()
 
-    if user_info_response.status_code != 200:
-        raise HTTPException(status_code=user_info_response.status_code, detail=FAILED_FETCH_USER_INFO)
+        try:
+            await redis_db.set_dict(f'info:{user_uuid}', microsoft_data)
+        except RedisError:
+            pass
 
-    microsoft_data = user_info_response.json()
+        return microsoft_data
 
-    await redis_db.set_dict(f'{prefix}{user.uuid}', microsoft_data)
-    await redis_db.set_dict(f'{prefix}{user.uuid}_temp', 1, ex=3600 * 24)
+    microsoft_data = await redis_db.cached(
+        get_microsoft_info_cache_key(user.uuid),
+        MICROSOFT_INFO_TTL,
+        load_microsoft_me,
+        stale_ttl=MICROSOFT_INFO_STALE_TTL
+    )
 
-    if microsoft_data is not None and "displayName" in microsoft_data:
+    # Outside of the loader, it may run in the background after this session is closed
+    if "displayName" in microsoft_data and microsoft_data['displayName'] != user.name:
         stmt = update(user_db).where(user_db.c.uuid == user.uuid).values(name=microsoft_data['displayName'])
         await session.execute(stmt)
         await session.commit()
 
-    return microsoft_data
-
-
-async def get_microsoft_me_photo(user: UserToken, session: AsyncSession):
-    prefix = 'user_image:'
-    image_path = await redis_db.get(f"{prefix}{user.uuid}")
-    
-    if image_path is None:
-        async with microsoft_oauth_client.get_httpx_client() as client:
-            user_photo_response = await client.get(
-                f"https://graph.microsoft.com/v1.0/me/photo/$value",
-                headers={"Authorization": f"Bearer {user.microsoft_access_token}"}
-            )
+        await reset_workers_cache()
 
-        if user_photo_response.status_code != 200:
-            image_path = ""
+    return microsoft_data
 
-        else:
-            file_content = user_photo_response.content
 
-            file = UploadFile(
-                filename=f"{user.uuid}.jpg",
-                file=io.BytesIO(file_content),
-                headers={"content-type": "image/jpeg"}
-            )
+async def get_microsoft_me_photo(user: UserToken):
+    """
+    Cached photo path. Missing or stale entries are revalidated by services.profile_photo_fetcher,
+    meanwhile the last stored path (or None) is returned, Graph is never called from the request.
+    """
 
-            img_save = (await upload_file(user, file, session)).result
-            image_path = img_save.file_name
+    user_uuid = str(user.uuid)
+    microsoft_access_token = user.microsoft_access_token
 
-        await redis_db.set(f"{prefix}{user.uuid}", image_path, ex=7200)
-        await redis_db.set(f"{prefix}{user.uuid}_value", image_path)
+    async def load_photo_path():
+        enqueue_profile_photo(user_uuid, microsoft_access_token)
+        return await get_user_image_path(user_uuid)
 
-    return image_path if image_path != "" else None
+    # The photo state lives in Redis, without it the photo is left out
+    try:
+        return await redis_db.cached(
+            get_photo_cache_key(user_uuid),
+            PHOTO_FRESH_TTL,
+            load_photo_path,
+            stale_ttl=PHOTO_RETENTION_TTL,
+            negative_ttl=PHOTO_FRESH_TTL
+        )
+    except RedisError:
+        return None
 
 
 
 @router_users.get('/me', response_model=BaseTokenResponse[UserReadMicrosoft])
 async def get_me_user(user: UserToken = Depends(get_current_user), session: AsyncSession = Depends(get_async_session)):
     microsoft_me_info = await get_microsoft_me(user, session)
-    microsoft_me_photo = await get_microsoft_me_photo(user, session)
+    microsoft_me_photo = await get_microsoft_me_photo(user)
     
     return BaseTokenResponse(
         new_token=user.new_token,
@@ -152,6 +160,39 @@ async def get_me_user(user: UserToken = Depends(get_current_user), session: Asyn
         ),
     )
 
+def user_name_search(query: str):
+    """
+    Case-insensitive substring match served by ix_user_name_trgm and its similarity rank.
+    """
+
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+    condition = user_db.c.name.ilike(f"%{escaped}%", escape="\\")
+    rank = func.similarity(user_db.c.name, query)
+
+    return condition, rank
+
+
+@router_users.get('/suggest', response_model=BaseTokenResponse[list[UserSuggest]])
+async def suggest_users(
+        q: str = Query(..., min_length=USER_SEARCH_MIN_LENGTH),
+        limit: int = 10,
+        user: UserToken = Depends(get_current_user),
+        session: AsyncSession = Depends(get_async_session)
+    ):
+
+    limit = min(max(1, limit), 20)
+    condition, rank = user_name_search(q)
+
+    stmt = select(user_db.c.uuid, user_db.c.name).where(condition).order_by(rank.desc(), user_db.c.name).limit(limit)
+    rows = (await session.execute(stmt)).fetchall()
+
+    return BaseTokenResponse(
+        new_token=user.new_token,
+        result=[UserSuggest(uuid=row.uuid, name=row.name) for row in rows]
+    )
+
+
 @router_users.get('/{uuid}', response_model=BaseTokenResponse[UserReadMicrosoft])
 async def get_user_by_uuid(uuid: str, user: UserToken = Depends(get_current_user), session: AsyncSession = Depends(get_async_session)):
 
@@ -175,7 +216,7 @@ async def get_users(
         user: UserToken = Depends(get_current_user),
         session: AsyncSession = Depends(get_async_session),
 
-        display_name: str | None = None,
+        display_name: str | None = Query(None, min_length=USER_SEARCH_MIN_LENGTH),
         is_superuser: bool | None = None,
         group_id: int | None = None,
         limit: int = 10,
@@ -187,7 +228,7 @@ async def get_users(
 
     total_pages_stmt = select(func.count(user_db.c.uuid))
 
-    stmt = select(user_db).limit(limit).offset(page * limit)
+    stmt = select_users_with_group().limit(limit).offset(page * limit)
 
     if is_superuser is not None:
         stmt = stmt.where(user_db.c.is_superuser == is_superuser)
@@ -198,30 +239,15 @@ async def get_users(
         total_pages_stmt = total_pages_stmt.where(user_db.c.group_id == group_id)
 
     if display_name is not None:
-        stmt = stmt.filter(user_db.c.name.like(f'%{display_name}%'))
-        total_pages_stmt = total_pages_stmt.filter(user_db.c.name.like(f'%{display_name}%'))
+        condition, rank = user_name_search(display_name)
+
+        stmt = stmt.filter(condition).order_by(rank.desc(), user_db.c.name)
+        total_pages_stmt = total_pages_stmt.filter(condition)
 
     result = await session.execute(stmt)
     data = result.fetchall()
 
-    users = []
-
-    for user_ in data:
-        group = await get_group_by_id(id=user_.group_id, session=session)
-        if group is None:
-            group = await get_default_group(session=session)
-
-        users.append(
-            UserReadMicrosoft(
-                uuid=user_.uuid,
-                is_superuser=user_.is_superuser,
-                name=user_.name,
-                group=group,
-
-                microsoft= await get_microsoft_user_info(user_.uuid),
-                image_path= await get_user_image_path(user_.uuid)
-            )
-        )
+    users = await read_users_microsoft(data, session)
 
     current_page = page + 1
     total_pages = await session.scalar(total_pages_stmt)
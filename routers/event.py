@@ -49,7 +49,7 @@ from auth import (
     UserToken,
 )
 from details import *
-from routers.uploader import STATIC_IMAGES_DIR
+from images import image_exists
 from shared.utils.events import get_max_date, create_events_before, check_overlapping, repeatability
 from shared import time_manager
 from config import config
@@ -73,7 +73,7 @@ async def create_event(
     user: UserToken = Depends(get_current_user),
     session: AsyncSession = Depends(get_async_session)
 ):
-    if event_data.img is not None and not os.path.exists(f'{STATIC_IMAGES_DIR}/{event_data.img}'):
+    if event_data.img is not None and not await image_exists(event_data.img, session):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=IMAGE_NOT_EXISTS
@@ -397,7 +397,7 @@ async def edit_event(
     if event_data.img is not None or event_data.img == "":
         if event_data.img == "":
             event_data.img = None
-        elif not os.path.exists(f'{STATIC_IMAGES_DIR}/{event_data.img}'):
+        elif not await image_exists(event_data.img, session):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=IMAGE_NOT_EXISTS
@@ -6,6 +6,7 @@ from database import redis_db, get_async_session
 from auth import *
 from models_ import group as group_db, user as user_db
 from permissions import get_depend_user_with_perms, Permissions
+from auth.workers_cache import reset_workers_cache
 
 from fastapi import APIRouter, HTTPException, Request, Depends, Body, status
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -156,6 +157,7 @@ async def delete_group(
     ), session)
 
     await session.commit()
+    await reset_workers_cache()
 
     return BaseTokenResponse(
         new_token=user.new_token,
@@ -204,6 +206,7 @@ async def update_group(
         ), session)
 
     await session.commit()
+    await reset_workers_cache()
 
     select_statement = select(group_db).where(group_db.c.id == group.id)
     row = (await session.execute(select_statement)).fetchone()
@@ -255,6 +258,7 @@ async def update_group(
         ), session)
 
     await session.commit()
+    await reset_workers_cache()
 
     return BaseTokenResponse(
         new_token=user.new_token,
@@ -6,9 +6,7 @@ from fastapi import (
 )
 from schemas.token import BaseTokenResponse
 from fastapi.params import File
-import os
-import hmac
-import hashlib
+import asyncio
 from auth import get_current_user
 from schemas.uploader import (
     ImgSave,
@@ -41,6 +39,20 @@ from action_history import add_action_to_history, HistoryActions
 from schemas import ActionHistoryCreate
 from database import get_async_session
 from sqlalchemy.ext.asyncio import AsyncSession
+from images import (
+    IMAGE_TYPES,
+    ImageTooLargeError,
+    UnsupportedImageError,
+    save_upload,
+    get_content_addressed_name,
+    store_upload,
+    discard_upload,
+    read_image_info,
+    remove_image_file,
+    register_image,
+    release_image
+)
+from details import IMAGE_TOO_LARGE, UNSUPPORTED_IMAGE_TYPE
 
 router = APIRouter(
     prefix="/img",
@@ -48,9 +60,6 @@ router = APIRouter(
 )
 
 OBJECT_TABLE = "image"
-STATIC_IMAGES_DIR = "./static/img"
-ALGORITHM = "HS256"
-SECRET = config['Miscellaneous']['secret']
 
 
 @router.post("/", response_model=BaseTokenResponse[ImgSave])
@@ -59,21 +68,44 @@ async def upload(
     file: UploadFile = File(...),
     session: AsyncSession = Depends(get_async_session)
 ):
-    data_to_hash = f"{datetime.now().strftime('%Y%m%d%H%M%S')}{current_user.uuid}"
-    hash_name = hmac.new(SECRET.encode(), data_to_hash.encode(), hashlib.sha256).hexdigest()
+    try:
+        tmp_path, type_of_image, digest = await save_upload(file)
+    except ImageTooLargeError:
+        raise HTTPException(status_code=413, detail=IMAGE_TOO_LARGE)
+    except UnsupportedImageError:
+        raise HTTPException(status_code=415, detail=UNSUPPORTED_IMAGE_TYPE)
+    except Exception as e:
+        logging.exception(e)
+        raise HTTPException(status_code=500, detail="Failed to save file")
+
+    # Identical images share one file
+    file_name = get_content_addressed_name(digest, type_of_image)
+    content_type = IMAGE_TYPES[type_of_image][0]
 
-    type_of_image = ".png" 
-    if file.filename.endswith(".png"):
-        type_of_image = ".png"
-    elif file.filename.endswith(".jpg") or file.filename.endswith(".jpeg"):
-        type_of_image = ".jpeg"
+    try:
+        size, width, height = await asyncio.to_thread(read_image_info, tmp_path)
+    except UnsupportedImageError:
+        await discard_upload(tmp_path)
+        raise HTTPException(status_code=415, detail=UNSUPPORTED_IMAGE_TYPE)
+    except Exception as e:
+        logging.exception(e)
+        await discard_upload(tmp_path)
+        raise HTTPException(status_code=500, detail="Failed to save file")
 
-    file_name = str(hash_name) + type_of_image  # сохраняем в переменную
-    new_path = os.path.join(STATIC_IMAGES_DIR, file_name)
+    # Locks the row until commit, a concurrent delete of the same content waits or is waited for
+    await register_image(
+        session,
+        file_name=file_name,
+        hash=digest,
+        size=size,
+        width=width,
+        height=height,
+        mime_type=content_type,
+        owner_uuid=current_user.uuid
+    )
 
     try:
-        with open(new_path, "wb") as buffer:
-            buffer.write(await file.read())
+        await store_upload(tmp_path, file_name, content_type)
     except Exception as e:
         logging.exception(e)
         raise HTTPException(status_code=500, detail="Failed to save file")
@@ -81,7 +113,7 @@ async def upload(
     res = ImgSave(
         date=datetime.utcnow(),
         file_name=file_name,  
-        content_type=file.content_type
+        content_type=content_type
     )
     
     await add_action_to_history(
@@ -92,7 +124,7 @@ async def upload(
             object_id=file_name,
             detail={
                 "file_name": file_name,
-                "content_type": file.content_type,
+                "content_type": content_type,
                 "original_filename": file.filename
             }
         ),
@@ -108,19 +140,15 @@ async def upload(
 
 
 
-@router.delete("/{file_name}", response_model=BaseTokenResponse[ImgDelete])
+@router.delete("/{file_name:path}", response_model=BaseTokenResponse[ImgDelete])
 async def delete_file(
         file_name: str,
         current_user: UserToken = Depends(get_depend_user_with_perms([Permissions.image_delete.value])),
         session: AsyncSession = Depends(get_async_session)
 ):
-    files_list = os.listdir(STATIC_IMAGES_DIR)
+    ref_count = await release_image(file_name, session)
 
-    if file_name in files_list:
-
-        file_path = os.path.join(STATIC_IMAGES_DIR, file_name)
-
-        os.remove(file_path)
+    if ref_count is not None:
 
         res = ImgDelete(
             date=datetime.utcnow(),
@@ -130,17 +158,19 @@ async def delete_file(
 
         action_detail = {"file_name": file_name}
 
-        stmt = update(event_db).where(event_db.c.img == file_name).returning(event_db.c.id).values(img=None)
-        events = await session.execute(stmt)
-        events = events.scalars().all()
-        if len(events) > 0:
-            action_detail["events"] = events
+        # Other uploads of the same content keep the file and its references
+        if ref_count == 0:
+            stmt = update(event_db).where(event_db.c.img == file_name).returning(event_db.c.id).values(img=None)
+            events = await session.execute(stmt)
+            events = events.scalars().all()
+            if len(events) > 0:
+                action_detail["events"] = events
 
-        stmt = update(room_db).where(room_db.c.img == file_name).returning(room_db.c.id).values(img=None)
-        rooms = await session.execute(stmt)
-        rooms = rooms.scalars().all()
-        if len(rooms) > 0:
-            action_detail["rooms"] = rooms
+            stmt = update(room_db).where(room_db.c.img == file_name).returning(room_db.c.id).values(img=None)
+            rooms = await session.execute(stmt)
+            rooms = rooms.scalars().all()
+            if len(rooms) > 0:
+                action_detail["rooms"] = rooms
 
         await add_action_to_history(
             ActionHistoryCreate(
@@ -153,6 +183,10 @@ async def delete_file(
             session
         )
         
+        # While the row is still locked, so an upload of the same content stores it after this
+        if ref_count == 0:
+            await remove_image_file(file_name)
+
         await session.commit()
 
         return BaseTokenResponse(
@@ -13,6 +13,11 @@ from sqlalchemy import update, select, insert, delete
 from functools import partial
 from action_history import add_action_to_history, HistoryActions
 from schemas.user import UserToken
+from database import redis_db, json_dumps, json_loads
+from redis.exceptions import RedisError
+import logging
+from auth.auth import select_users_with_group, read_users_microsoft
+from auth.workers_cache import WORKERS_CACHE_KEY, WORKERS_CACHE_TTL, reset_workers_cache
 
 router = APIRouter(
     prefix="/workers",
@@ -60,6 +65,7 @@ async def create_worker(
     ), session)
 
     await session.commit()
+    await reset_workers_cache()
 
     return BaseTokenResponse(
         new_token=user.new_token,
@@ -68,39 +74,51 @@ async def create_worker(
 
 @router.get('/', response_model=list[UserReadMicrosoft])
 async def get_workers(
+        limit: int | None = None,
+        page: int = 1,
         session: AsyncSession = Depends(get_async_session)
     ):
 
-    select_statement = select(user_db).join(worker_db, worker_db.c.user_uuid == user_db.c.uuid)
-    data = await session.execute(select_statement)
-    rows = data.fetchall()
+    users = await get_cached_workers()
 
-    users: list[UserReadMicrosoft] = []
-    
-    for user_ in rows:
-        user_ = user_._mapping
-    
-        group = await get_group_by_id(id=user_['group_id'], session=session)
-        if group is None:
-            group = await get_default_group(session=session)
+    if users is None:
+        select_statement = select_users_with_group().join(
+            worker_db, worker_db.c.user_uuid == user_db.c.uuid
+        ).order_by(user_db.c.name)
 
-    
-        microsoft_info = await get_microsoft_user_info(user_['uuid'])
-        microsoft_image = await get_user_image_path(user_['uuid'])
-
-        users.append(
-            UserReadMicrosoft(
-                uuid=user_['uuid'],
-                is_superuser=user_['is_superuser'],
-                name=user_['name'],
-                group=group,
-                microsoft = microsoft_info,
-                image_path = microsoft_image
+        rows = (await session.execute(select_statement)).fetchall()
+        users = await read_users_microsoft(rows, session)
+
+        try:
+            await redis_db.set(
+                WORKERS_CACHE_KEY,
+                json_dumps([user_.model_dump() for user_ in users]),
+                ex=WORKERS_CACHE_TTL
             )
-        )
+        except RedisError:
+            pass
+
+    if limit is not None:
+        limit = min(max(1, limit), 60)
+        page = max(1, page) - 1
+
+        users = users[page * limit:(page + 1) * limit]
 
     return users
 
+
+async def get_cached_workers() -> list[UserReadMicrosoft] | None:
+    try:
+        data = await redis_db.get(WORKERS_CACHE_KEY)
+    except RedisError:
+        return None
+
+    if data is None:
+        return None
+
+    return [UserReadMicrosoft(**user_) for user_ in json_loads(data)]
+
+
 @router.delete(
     '/{uuid}',
     response_model=BaseTokenResponse[str]
@@ -124,6 +142,7 @@ async def delete_worker(
     ), session)
 
     await session.commit()
+    await reset_workers_cache()
 
     return BaseTokenResponse(
         new_token=user.new_token,
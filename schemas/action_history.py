@@ -25,6 +25,9 @@ class ActionHistoryRead(BaseModel):
     object_id: int | UUID | str | None = None
     detail: dict | ActionHistoryDetailUpdate
 
+class ActionHistoryTimelineRead(ActionHistoryRead):
+    state: dict | None = None
+
 class ActionHistoryCreate(BaseModel):
     action: str
     subject_uuid: UUID
@@ -22,6 +22,10 @@ class UserCreate(BaseModel):
     name: str | None
     is_superuser: bool = False
 
+class UserSuggest(BaseModel):
+    uuid: uuid.UUID
+    name: str | None
+
 class UserRead(UserCreate):
     group: GroupRead | None
 
@@ -1,2 +1,9 @@
-from .tmp_image_remover import subscribe_expired_keys
-from .repeat_event_updater import repeat_event_updater
\ No newline at end of file
+from .tmp_image_remover import tmp_image_remover
+from .repeat_event_updater import repeat_event_updater
+from .action_history_writer import action_history_writer
+from .action_history_archiver import action_history_archiver
+from .profile_photo_fetcher import profile_photo_fetcher
+from .directory_sync import directory_sync
+from .token_refresher import token_refresher
+from .cache_invalidation import cache_invalidation_listener
+from .image_gc import image_gc
@@ -0,0 +1,128 @@
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import datetime
+
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from action_history import get_month_start
+from config import config
+from database import async_session_maker, json_dumps_bytes
+from models_ import action_history as action_history_db
+
+RETENTION_MONTHS = int(config.get("ActionHistory", "retention_months", 12))
+PARTITIONS_AHEAD = int(config.get("ActionHistory", "partitions_ahead", 2))
+ARCHIVE_DIR = config["ActionHistory"]["archive_dir"]
+
+PARTITION_PREFIX = "action_history_p"
+PARTITION_NAME = re.compile(rf"^{PARTITION_PREFIX}(\d{{4}})_(\d{{2}})$")
+ADVISORY_LOCK_ID = 2_133_610_237
+FETCH_SIZE = 1000
+
+
+def get_partition_name(month_start: datetime) -> str:
+    return f"{PARTITION_PREFIX}{month_start.strftime('%Y_%m')}"
+
+
+async def ensure_partitions(session: AsyncSession):
+    month_start = get_month_start(datetime.utcnow())
+
+    for i in range(PARTITIONS_AHEAD + 1):
+        start = month_start + relativedelta(months=i)
+        end = start + relativedelta(months=1)
+
+        await session.execute(text(
+            f'CREATE TABLE IF NOT EXISTS "{get_partition_name(start)}" PARTITION OF action_history '
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        ))
+
+
+async def get_partitions(session: AsyncSession) -> list[tuple[str, datetime]]:
+    result = await session.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'action_history'::regclass"
+    ))
+
+    partitions = []
+
+    for name in result.scalars().all():
+        match = PARTITION_NAME.match(name)
+
+        if match is not None:
+            partitions.append((name, datetime(int(match[1]), int(match[2]), 1)))
+
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+async def archive_partition(session: AsyncSession, name: str, month_start: datetime):
+    """
+    Export one monthly partition to `<ARCHIVE_DIR>/<name>.ndjson.gz`, then detach and drop it.
+    """
+
+    path = os.path.join(ARCHIVE_DIR, f"{name}.ndjson.gz")
+    tmp_path = f"{path}.tmp"
+
+    stmt = select(action_history_db).where(
+        action_history_db.c.date >= month_start,
+        action_history_db.c.date < month_start + relativedelta(months=1)
+    ).order_by(action_history_db.c.id)
+
+    result = await session.stream(stmt)
+    file = await asyncio.to_thread(gzip.open, tmp_path, "wb")
+    count = 0
+
+    try:
+        async for rows in result.mappings().partitions(FETCH_SIZE):
+            chunk = b"".join(json_dumps_bytes(dict(row)) + b"\n" for row in rows)
+            await asyncio.to_thread(file.write, chunk)
+            count += len(rows)
+    finally:
+        await asyncio.to_thread(file.close)
+
+    await asyncio.to_thread(os.replace, tmp_path, path)
+
+    await session.execute(text(f'ALTER TABLE action_history DETACH PARTITION "{name}"'))
+    await session.execute(text(f'DROP TABLE "{name}"'))
+
+    logging.info(f"Archived {count} actions from {name} to {path}")
+
+
+async def action_history_maintenance():
+    async with async_session_maker() as session:
+        # Only one worker maintains the partitions at a time
+        locked = await session.scalar(text(f"SELECT pg_try_advisory_xact_lock({ADVISORY_LOCK_ID})"))
+        if not locked:
+            return
+
+        await ensure_partitions(session)
+        await session.commit()
+
+    retention_boundary = get_month_start(datetime.utcnow()) - relativedelta(months=RETENTION_MONTHS)
+    await asyncio.to_thread(os.makedirs, ARCHIVE_DIR, exist_ok=True)
+
+    async with async_session_maker() as session:
+        for name, month_start in await get_partitions(session):
+            if month_start + relativedelta(months=1) > retention_boundary:
+                break
+
+            locked = await session.scalar(text(f"SELECT pg_try_advisory_xact_lock({ADVISORY_LOCK_ID})"))
+            if not locked:
+                return
+
+            await archive_partition(session, name, month_start)
+            await session.commit()
+
+
+async def action_history_archiver():
+    while True:
+        try:
+            await action_history_maintenance()
+        except Exception as e:
+            logging.exception(e)
+
+        await asyncio.sleep(24 * 3600)
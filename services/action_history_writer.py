@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from uuid import UUID
+
+from redis.exceptions import ConnectionError, ResponseError
+
+from action_history import ACTION_HISTORY_MODE, ACTION_HISTORY_STREAM
+from config import config
+from database import async_session_maker, redis_db, json_loads
+
+GROUP_NAME = "action_history_writer"
+CONSUMER_NAME = f"writer-{os.getpid()}"
+BATCH_SIZE = int(config.get("ActionHistory", "stream_batch_size", 500))
+BLOCK_MS = 5000
+CLAIM_IDLE_MS = 60 * 1000
+
+COLUMNS = ["action", "date", "subject_uuid", "object_table", "object_id", "detail"]
+
+
+def _to_record(fields: dict) -> tuple:
+    data = json_loads(fields["payload"])
+
+    return (
+        data["action"],
+        datetime.fromisoformat(data["date"]),
+        UUID(data["subject_uuid"]),
+        data["object_table"],
+        data["object_id"],
+        fields["detail"],
+    )
+
+
+async def write_entries(stream_key: str, entries: list):
+    if not entries:
+        return
+
+    ids = [entry_id for entry_id, _ in entries]
+    records = [_to_record(fields) for _, fields in entries]
+
+    async with async_session_maker() as session:
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+
+        await raw_connection.driver_connection.copy_records_to_table(
+            "action_history",
+            records=records,
+            columns=COLUMNS
+        )
+        await session.commit()
+
+    await redis_db.xack(stream_key, GROUP_NAME, *ids)
+    await redis_db.xdel(stream_key, *ids)
+
+
+async def action_history_writer():
+    if ACTION_HISTORY_MODE != "stream":
+        return
+
+    stream_key = redis_db._add_prefix(ACTION_HISTORY_STREAM)
+
+    while True:
+        try:
+            try:
+                await redis_db.xgroup_create(stream_key, GROUP_NAME, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+            # Entries left unacknowledged by a stopped worker
+            _, claimed, *_ = await redis_db.xautoclaim(
+                stream_key, GROUP_NAME, CONSUMER_NAME,
+                min_idle_time=CLAIM_IDLE_MS, count=BATCH_SIZE
+            )
+            await write_entries(stream_key, claimed)
+
+            while True:
+                # Waiting for entries is not a slow Redis
+                with redis_db.command_timeout(None):
+                    response = await redis_db.xreadgroup(
+                        GROUP_NAME, CONSUMER_NAME,
+                        {stream_key: ">"},
+                        count=BATCH_SIZE, block=BLOCK_MS
+                    )
+
+                for _, entries in response:
+                    await write_entries(stream_key, entries)
+
+        except ConnectionError as e:
+            logging.info(f"Connection error: {e}. Reconnecting in 5 seconds...")
+            await asyncio.sleep(5)
+
+        except Exception as e:
+            logging.exception(e)
+            await asyncio.sleep(5)
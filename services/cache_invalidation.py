@@ -0,0 +1,45 @@
+import asyncio
+import logging
+
+from redis.exceptions import ConnectionError
+
+from database import redis_db
+from database.redis_ import L1_INVALIDATION_CHANNEL
+
+
+async def cache_invalidation_listener():
+    """
+    Evict keys other workers changed from this worker's L1 cache.
+
+    The cache is only filled while subscribed, invalidations sent meanwhile would be lost.
+    """
+
+    l1 = redis_db.l1
+
+    if l1 is None:
+        return
+
+    while True:
+        pubsub = redis_db.pubsub()
+
+        try:
+            await pubsub.subscribe(redis_db._add_prefix(L1_INVALIDATION_CHANNEL))
+            l1.clear()
+            l1.active = True
+
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    l1.evict(message["data"].split("\n"))
+
+        except ConnectionError as e:
+            logging.info(f"Connection error: {e}. Reconnecting in 5 seconds...")
+
+        except Exception as e:
+            logging.exception(e)
+
+        finally:
+            l1.active = False
+            l1.clear()
+            await pubsub.aclose()
+
+        await asyncio.sleep(5)
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+
+import httpx
+from sqlalchemy import select, update, bindparam
+
+from auth.graph import CLIENT_ID, CLIENT_SECRET, TENANT, DeltaLinkExpired, get_application_token, iterate_users_delta
+from config import config
+from auth.auth import MICROSOFT_INFO_TTL, MICROSOFT_INFO_STALE_TTL, get_microsoft_info_cache_key
+from auth.workers_cache import reset_workers_cache
+from database import async_session_maker, redis_db, encode_cache_entry
+from models_ import user as user_db
+
+SYNC_INTERVAL = int(config.get("Microsoft", "directory_sync_interval", 3600))
+
+DELTA_LINK_KEY = "directory_sync:delta_link"
+LOCK_KEY = "directory_sync:lock"
+
+INFO_PREFIX = "info:"
+
+
+async def apply_directory_changes(users: list[dict]) -> int:
+    """
+    Write one page of changed Graph users to the user table and the `info:` cache.
+
+    Only users that already signed in are kept, names are updated in one batch.
+    """
+
+    users = {user["id"]: user for user in users if "@removed" not in user and "id" in user}
+
+    if not users:
+        return 0
+
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(user_db.c.uuid, user_db.c.name).where(user_db.c.uuid.in_(users.keys()))
+        )
+        known = {str(uuid): name for uuid, name in result.all()}
+
+        renamed = [
+            {"b_uuid": uuid, "b_name": users[uuid]["displayName"]}
+            for uuid, name in known.items()
+            if users[uuid].get("displayName") and users[uuid]["displayName"] != name
+        ]
+
+        if renamed:
+            stmt = update(user_db).where(user_db.c.uuid == bindparam("b_uuid")).values(name=bindparam("b_name"))
+            await session.execute(stmt, renamed)
+            await session.commit()
+
+    if not known:
+        return 0
+
+    uuids = list(known.keys())
+    cached = await redis_db.get_dict_many([f"{INFO_PREFIX}{uuid}" for uuid in uuids])
+
+    infos = {}
+    for uuid, info in zip(uuids, cached):
+        info = info or {}
+        info.update({key: value for key, value in users[uuid].items() if not key.startswith("@")})
+        infos[f"{INFO_PREFIX}{uuid}"] = info
+
+    await redis_db.set_dict_many(infos)
+
+    async with redis_db.pipeline(transaction=False) as pipe:
+        for uuid in uuids:
+            entry, ex = encode_cache_entry(infos[f"{INFO_PREFIX}{uuid}"], MICROSOFT_INFO_TTL, MICROSOFT_INFO_STALE_TTL)
+            pipe.set(get_microsoft_info_cache_key(uuid), entry, ex=ex)
+
+        await pipe.execute()
+
+    await reset_workers_cache()
+
+    return len(renamed)
+
+
+async def sync_directory():
+    delta_link = await redis_db.get(DELTA_LINK_KEY)
+    renamed = 0
+
+    async with httpx.AsyncClient() as client:
+        token = await get_application_token(client)
+
+        try:
+            async for users, next_delta_link in iterate_users_delta(client, token, delta_link):
+                renamed += await apply_directory_changes(users)
+
+                if next_delta_link is not None:
+                    delta_link = next_delta_link
+
+        except DeltaLinkExpired:
+            logging.info("Directory delta link expired, running a full sync")
+            await redis_db.delete(DELTA_LINK_KEY)
+            return await sync_directory()
+
+    if delta_link is not None:
+        await redis_db.set(DELTA_LINK_KEY, delta_link)
+
+    logging.info(f"Directory sync finished, {renamed} users renamed")
+
+
+async def directory_sync():
+    # Delta queries on /users need an application registered in a specific tenant
+    if not CLIENT_ID or not CLIENT_SECRET or TENANT == "common":
+        return
+
+    while True:
+        try:
+            # Only one worker syncs per interval
+            if await redis_db.set(LOCK_KEY, 1, nx=True, ex=SYNC_INTERVAL):
+                await sync_directory()
+        except Exception as e:
+            logging.exception(e)
+
+        await asyncio.sleep(SYNC_INTERVAL)
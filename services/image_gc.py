@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, exists
+
+from config import config
+from database import async_session_maker, redis_db
+from images import image_storage, remove_image_file, StoredFile, UPLOAD_FILE_NAME, IMAGE_TYPES
+from models_ import event as event_db, room as room_db, image as image_db
+
+GC_INTERVAL = int(config.get("Images", "gc_interval", 24 * 3600))
+# Files younger than this are kept, an upload is referenced by an event or room only after it is stored
+GC_GRACE_PERIOD = int(config.get("Images", "gc_grace_period", 24 * 3600))
+GC_PAGE_SIZE = int(config.get("Images", "gc_page_size", 500))
+
+LOCK_KEY = "image_gc:lock"
+# files_scanned, files_deleted, bytes_reclaimed and runs in total, last_* for the latest run
+STATS_KEY = "image_gc:stats"
+
+# Scratch files of uploads that never finished, see images.save_upload
+TMP_SUFFIX = ".tmp"
+
+
+async def sweep_orphans(names: list[str], cutoff: datetime) -> list[str]:
+    """
+    Drop the registry rows of `names` no event or room uses and uploaded before `cutoff`, then their files.
+
+    The check and the delete are one statement, and the files go before commit while the rows
+    are locked, so an image uploaded again or referenced meanwhile is kept (see images.release_image).
+    """
+
+    stmt = delete(image_db).where(
+        image_db.c.file_name.in_(names),
+        image_db.c.uploaded_at < cutoff.replace(tzinfo=None),
+        ~exists().where(event_db.c.img == image_db.c.file_name),
+        ~exists().where(room_db.c.img == image_db.c.file_name)
+    ).returning(image_db.c.file_name)
+
+    async with async_session_maker() as session:
+        orphans = (await session.execute(stmt)).scalars().all()
+
+        for file_name in orphans:
+            await remove_image_file(file_name)
+
+        await session.commit()
+
+    return orphans
+
+
+async def collect_page(files: list[StoredFile], cutoff: datetime) -> list[StoredFile]:
+    """
+    Sweep the uploads of one page that belong to no event or room, returns the files removed from it.
+
+    Files without a registry row are left alone, the registry migration registered the older uploads.
+    """
+
+    tmp_files = [file for file in files if file.name.endswith(TMP_SUFFIX) and file.modified < cutoff]
+    candidates: dict[str, list[StoredFile]] = {}
+
+    for file in files:
+        match = UPLOAD_FILE_NAME.match(file.name)
+
+        if match is not None and file.modified < cutoff:
+            candidates.setdefault(match[1], []).append(file)
+
+    garbage = list(tmp_files)
+
+    if candidates:
+        names = [f"{stem}{extension}" for stem in candidates for extension in IMAGE_TYPES]
+        orphans = await sweep_orphans(names, cutoff)
+
+        # Variants of an orphan on other pages are removed as well, only this page is counted
+        garbage.extend(file for name in orphans for file in candidates[UPLOAD_FILE_NAME.match(name)[1]])
+
+    if tmp_files:
+        await image_storage.delete(*(file.name for file in tmp_files))
+
+    return garbage
+
+
+async def collect_garbage():
+    started = time.monotonic()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=GC_GRACE_PERIOD)
+
+    scanned = deleted = reclaimed = 0
+
+    async for files in image_storage.iterate_files(GC_PAGE_SIZE):
+        garbage = await collect_page(files, cutoff)
+
+        scanned += len(files)
+        deleted += len(garbage)
+        reclaimed += sum(file.size for file in garbage)
+
+    duration = round(time.monotonic() - started, 3)
+
+    async with redis_db.pipeline(transaction=False) as pipe:
+        pipe.hincrby(STATS_KEY, "runs", 1)
+        pipe.hincrby(STATS_KEY, "files_scanned", scanned)
+        pipe.hincrby(STATS_KEY, "files_deleted", deleted)
+        pipe.hincrby(STATS_KEY, "bytes_reclaimed", reclaimed)
+        pipe.hset(STATS_KEY, mapping={
+            "last_run": datetime.utcnow().isoformat(),
+            "last_duration": duration,
+            "last_files_scanned": scanned,
+            "last_files_deleted": deleted,
+            "last_bytes_reclaimed": reclaimed,
+        })
+
+        await pipe.execute()
+
+    logging.info(f"Image GC scanned {scanned} files in {duration}s, deleted {deleted} ({reclaimed} bytes)")
+
+
+async def image_gc():
+    while True:
+        try:
+            # Only one worker collects per interval
+            if await redis_db.set(LOCK_KEY, 1, nx=True, ex=GC_INTERVAL):
+                await collect_garbage()
+        except Exception as e:
+            logging.exception(e)
+
+        await asyncio.sleep(GC_INTERVAL)
@@ -0,0 +1,21 @@
+import logging
+
+from auth.profile_photo import (
+    PHOTO_FRESH_TTL, PHOTO_RETENTION_TTL,
+    profile_photo_queue, queued_profile_photos, fetch_profile_photo, get_photo_cache_key
+)
+from database import redis_db
+
+
+async def profile_photo_fetcher():
+    while True:
+        user_uuid, microsoft_access_token = await profile_photo_queue.get()
+
+        try:
+            image_path = await fetch_profile_photo(user_uuid, microsoft_access_token)
+            await redis_db.set_cached(get_photo_cache_key(user_uuid), image_path, PHOTO_FRESH_TTL, PHOTO_RETENTION_TTL)
+        except Exception as e:
+            logging.exception(e)
+        finally:
+            queued_profile_photos.discard(user_uuid)
+            profile_photo_queue.task_done()
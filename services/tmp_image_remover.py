@@ -1,71 +1,130 @@
+import asyncio
 import logging
-from routers.uploader import STATIC_IMAGES_DIR
-from database import redis_db
+import time
 
-import os
 from redis.exceptions import ConnectionError
-import asyncio
 
-pubsub = redis_db.pubsub()
+from auth.profile_photo import PHOTO_EXPIRY_KEY, get_photo_file_names, get_photo_cache_key
+from auth.workers_cache import reset_workers_cache
+from config import config
+from database import redis_db
+from images import image_storage
+
+EXPIRY_INTERVAL = int(config.get("Images", "photo_expiry_interval", 60))
+BATCH_SIZE = 100
+
+LOCK_KEY = "user_image_expiry:lock"
+SEEDED_KEY = "user_image_expiry:seeded"
+PREFIX = "user_image:"
+# get_photo_cache_key without the uuid
+PHOTO_CACHE_PREFIX = get_photo_cache_key("")
+
+# Claims due users and drops their photo keys in one step, a photo fetched again meanwhile
+# keeps its new deadline and keys. Returns the claimed uuids and their stored paths
+CLAIM_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+local paths = {}
+for i, user_uuid in ipairs(due) do
+    local value_key = ARGV[3] .. user_uuid .. '_value'
+    redis.call('ZREM', KEYS[1], user_uuid)
+    paths[i] = redis.call('GET', value_key) or ''
+    redis.call('DEL', value_key, ARGV[3] .. user_uuid .. '_etag', ARGV[4] .. user_uuid)
+end
+return {due, paths}
+"""
 
-async def tmp_image_remover_task(message: dict):
-    key = str(message['data'])
-    allows_startswith = ["probook:user_image:"]
-    fl = True
 
-    for allow_startswith in allows_startswith:
-        fl = fl and key.startswith(allow_startswith)
+async def remove_photo_files(user_uuids: list[str], paths: list[str]):
+    # A login after the claim may have stored the same photo again under the same name
+    current_paths = await redis_db.mget([f"{PREFIX}{user_uuid}_value" for user_uuid in user_uuids])
+
+    file_names = [
+        file_name
+        for path, current_path in zip(paths, current_paths)
+        if path and path != current_path
+        for file_name in get_photo_file_names(path)
+    ]
+
+    if file_names:
+        await image_storage.delete(*file_names)
+
+
+async def remove_expired_photos() -> int:
+    removed = 0
+
+    while True:
+        user_uuids, paths = await redis_db.eval(
+            CLAIM_DUE_SCRIPT, 1, redis_db._add_prefix(PHOTO_EXPIRY_KEY),
+            time.time(), BATCH_SIZE, redis_db._add_prefix(PREFIX), redis_db._add_prefix(PHOTO_CACHE_PREFIX)
+        )
+
+        if not user_uuids:
+            return removed
 
-    if fl:
-        return await tmp_image_remover(key)
+        await redis_db.invalidate_l1(*(
+            key
+            for user_uuid in user_uuids
+            for key in (f"{PREFIX}{user_uuid}_value", f"{PREFIX}{user_uuid}_etag", get_photo_cache_key(user_uuid))
+        ))
+        await remove_photo_files(user_uuids, paths)
+        await reset_workers_cache()
+        removed += len(user_uuids)
 
 
-async def tmp_image_remover(key: str):
-    key = key + '_value'
-    
-    path = await redis_db.get_abs(key)
-    await redis_db.delete_abs(key)
+async def seed_expiry_queue():
+    """
+    Queue photos stored while expirations came from keyspace notifications, runs once per Redis database.
+    """
 
-    if path is None:
+    if await redis_db.get(SEEDED_KEY) is not None:
         return
 
-    file_path = os.path.join(STATIC_IMAGES_DIR, path)
+    prefix = redis_db._add_prefix(PREFIX)
+    user_uuids = []
 
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    async for key in redis_db.scan_iter(match=f"{prefix}*_value", count=1000):
+        user_uuids.append(key[len(prefix):-len("_value")])
 
+    now = time.time()
 
-async def subscribe_expired_keys():
-    await remove_trash("probook:user_image:", "_value")
-    
+    for i in range(0, len(user_uuids), BATCH_SIZE):
+        batch = user_uuids[i:i + BATCH_SIZE]
+
+        async with redis_db.pipeline(transaction=False) as pipe:
+            for user_uuid in batch:
+                pipe.ttl(f"{PREFIX}{user_uuid}")
+
+            ttls = await pipe.execute()
+
+        async with redis_db.pipeline(transaction=False) as pipe:
+            # A missing marker has already expired, those are due right away
+            pipe.zadd(PHOTO_EXPIRY_KEY, {user_uuid: now + max(ttl, 0) for user_uuid, ttl in zip(batch, ttls)}, nx=True)
+            pipe.delete(*(f"{PREFIX}{user_uuid}" for user_uuid in batch))
+
+            await pipe.execute()
+
+    # Only once every batch is queued, an interrupted run is repeated (ZADD NX keeps queued deadlines)
+    await redis_db.set(SEEDED_KEY, 1)
+
+    logging.info(f"Queued {len(user_uuids)} profile photos for expiry")
+
+
+async def tmp_image_remover():
     while True:
-        await pubsub.subscribe(**{'__keyevent@0__:expired': tmp_image_remover_task})
-        logging.info("Subscribe to key expiration notifications...")
-        
         try:
-            async for message in pubsub.listen():
-                pass
+            await seed_expiry_queue()
+
+            # Only one worker drains the queue per interval
+            if await redis_db.set(LOCK_KEY, 1, nx=True, ex=EXPIRY_INTERVAL):
+                removed = await remove_expired_photos()
+
+                if removed:
+                    logging.info(f"Removed {removed} expired profile photos")
+
         except ConnectionError as e:
-            logging.info(f"Connection error: {e}. Reconnecting in 5 seconds...")
-            await asyncio.sleep(5)
-        
-        finally:
-            await pubsub.close()
-            await redis_db.close()
-
-async def remove_trash(prefix: str, sufix: str):
-    cursor = 0
-    matching_keys = []
-    while True:
-        cursor, keys = await redis_db.scan(cursor=cursor, match=f"{prefix}*{sufix}", count=100)
-        
-        matching_keys.extend(keys)
-
-        if cursor == 0:
-            break
-        
-    for key in matching_keys:
-        key = key[:-len(sufix):]
-        
-        if await redis_db.get_abs(key) is None:
-            await tmp_image_remover(key)
\ No newline at end of file
+            logging.info(f"Connection error: {e}. Retrying in {EXPIRY_INTERVAL} seconds...")
+
+        except Exception as e:
+            logging.exception(e)
+
+        await asyncio.sleep(EXPIRY_INTERVAL)
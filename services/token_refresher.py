@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+
+from httpx_oauth.oauth2 import RefreshTokenError
+
+from auth.auth import microsoft_oauth_client, create_access_token
+from auth.session_store import update_session_tokens
+from auth.token_refresh import (
+    TOKEN_REFRESH_LEAD, SCHEDULE_KEY, SESSION_PREFIX,
+    set_refreshed_token, schedule_token_refresh
+)
+from config import config
+from database import redis_db
+
+REFRESH_INTERVAL = int(config.get("Microsoft", "token_refresh_interval", 30))
+BATCH_SIZE = 100
+
+
+async def refresh_session(session_id: str):
+    data = await redis_db.get_dict(f"{SESSION_PREFIX}{session_id}")
+
+    if data is None:
+        return
+
+    await redis_db.delete(f"{SESSION_PREFIX}{session_id}")
+
+    try:
+        token = await microsoft_oauth_client.refresh_token(refresh_token=data["refresh_token"])
+    except RefreshTokenError as e:
+        logging.info(f"Could not refresh session of {data['uuid']}: {e}")
+        return
+
+    if data.get("session_id") is not None:
+        updated = await update_session_tokens(
+            data["session_id"], token["access_token"], token["refresh_token"], token["expires_at"]
+        )
+
+        if updated:
+            await schedule_token_refresh(data["uuid"], token["refresh_token"], token["expires_at"], data["session_id"])
+
+        return
+
+    new_token = create_access_token(
+        user_uuid=data["uuid"],
+        microsoft_access_token=token["access_token"],
+        microsoft_refresh_token=token["refresh_token"],
+        expires_at=token["expires_at"]
+    )
+
+    await set_refreshed_token(data["refresh_token"], new_token, token["expires_at"])
+
+
+async def refresh_due_sessions():
+    while True:
+        session_ids = await redis_db.zrangebyscore(
+            redis_db._add_prefix(SCHEDULE_KEY), "-inf", time.time() + TOKEN_REFRESH_LEAD,
+            start=0, num=BATCH_SIZE
+        )
+
+        if not session_ids:
+            return
+
+        # ZREM succeeds for one worker only, so each session is refreshed once
+        async with redis_db.pipeline(transaction=False) as pipe:
+            for session_id in session_ids:
+                pipe.zrem(SCHEDULE_KEY, session_id)
+
+            claimed = await pipe.execute()
+
+        results = await asyncio.gather(*[
+            refresh_session(session_id)
+            for session_id, removed in zip(session_ids, claimed)
+            if removed
+        ], return_exceptions=True)
+
+        for result in results:
+            if isinstance(result, Exception):
+                logging.exception(result)
+
+
+async def token_refresher():
+    while True:
+        try:
+            await refresh_due_sessions()
+        except Exception as e:
+            logging.exception(e)
+
+        await asyncio.sleep(REFRESH_INTERVAL)
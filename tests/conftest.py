@@ -0,0 +1,72 @@
+import configparser
+import os
+import socket
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# config writes config.ini and images create the static directory relative to the working directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.chdir(tempfile.mkdtemp(prefix="probook-tests-"))
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+MICROSOFT_URL = f"http://127.0.0.1:{get_free_port()}"
+S3_URL = f"http://127.0.0.1:{get_free_port()}"
+
+# Point the Microsoft endpoints at tests.microsoft_stand_in before the app reads its config
+test_config = configparser.ConfigParser()
+test_config["Miscellaneous"] = {"secret": "probook-tests-secret-of-32-bytes-or-more"}
+test_config["Microsoft"] = {
+    "client_id": "client",
+    "client_secret": "secret",
+    "tenant_id": "72f988bf-86f1-41af-91ab-2d7cd011db47",
+    "graph_url": f"{MICROSOFT_URL}/graph/v1.0",
+    "login_url": f"{MICROSOFT_URL}/login",
+}
+
+with open("config.ini", "w", encoding="utf-8") as config_file:
+    test_config.write(config_file)
+
+
+@pytest.fixture(scope="session")
+def microsoft_server():
+    from tests.microsoft_stand_in import MicrosoftStandIn
+
+    server = MicrosoftStandIn(MICROSOFT_URL)
+    server.start()
+
+    yield server
+
+    server.stop()
+
+
+@pytest.fixture
+def microsoft(microsoft_server):
+    microsoft_server.reset()
+    return microsoft_server
+
+
+@pytest.fixture(scope="session")
+def s3_server():
+    from tests.s3_stand_in import S3StandIn
+
+    server = S3StandIn(S3_URL)
+    server.start()
+
+    yield server
+
+    server.stop()
+
+
+@pytest.fixture
+def s3(s3_server):
+    s3_server.reset()
+    return s3_server
@@ -0,0 +1,203 @@
+import asyncio
+import fnmatch
+import time
+
+from database import encode_dict, decode_dict
+
+
+class FakeRedis:
+    """
+    In-memory stand-in for redis_db.
+
+    Like CustomRedisClient, regular commands prefix their keys and raw ones
+    (zrangebyscore, scan_iter) take keys passed through _add_prefix.
+    """
+
+    def __init__(self, key_prefix: str = "probook"):
+        self.key_prefix = key_prefix
+        self.data: dict[str, object] = {}
+        self.expires: dict[str, float] = {}
+        self.commands: list[str] = []
+
+    async def _round_trip(self, command: str):
+        # Let other tasks run in between commands, as they would while waiting on Redis
+        self.commands.append(command)
+        await asyncio.sleep(0)
+
+    def _add_prefix(self, key: str) -> str:
+        return f"{self.key_prefix}:{key}"
+
+    def _read(self, key: str):
+        if key in self.expires and self.expires[key] <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+        # Redis drops sorted sets and hashes once their last member is removed
+        if self.data.get(key) == {}:
+            del self.data[key]
+
+        return self.data.get(key)
+
+    def dump(self) -> dict:
+        """
+        Live keys without the prefix.
+        """
+
+        prefix = self._add_prefix("")
+        return {key[len(prefix):]: self._read(key) for key in list(self.data) if self._read(key) is not None}
+
+    def pipeline(self, transaction: bool = True):
+        return FakePipeline(self)
+
+    async def get(self, key: str):
+        await self._round_trip("GET")
+        return self._read(self._add_prefix(key))
+
+    async def set(self, key: str, value, ex: int | None = None, nx: bool = False):
+        await self._round_trip("SET")
+        key = self._add_prefix(key)
+
+        if nx and self._read(key) is not None:
+            return None
+
+        self.data[key] = str(value)
+        self.expires.pop(key, None)
+
+        if ex is not None:
+            self.expires[key] = time.time() + ex
+
+        return True
+
+    async def delete(self, *keys: str) -> int:
+        await self._round_trip("DEL")
+        deleted = 0
+
+        for key in keys:
+            key = self._add_prefix(key)
+            deleted += self._read(key) is not None
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+        return deleted
+
+    async def mget(self, keys: list[str]) -> list:
+        await self._round_trip("MGET")
+        return [self._read(self._add_prefix(key)) for key in keys]
+
+    async def mset(self, mapping: dict) -> bool:
+        await self._round_trip("MSET")
+
+        for key, value in mapping.items():
+            self.data[self._add_prefix(key)] = str(value)
+
+        return True
+
+    async def get_dict(self, key: str):
+        return decode_dict(await self.get(key))
+
+    async def get_dict_many(self, keys: list[str]) -> list:
+        if not keys:
+            return []
+
+        return [decode_dict(value) for value in await self.mget(keys)]
+
+    async def set_dict_many(self, mapping: dict, ex: int | None = None):
+        if mapping:
+            await self.mset({key: encode_dict(data) for key, data in mapping.items()})
+
+    async def exists(self, *keys: str) -> int:
+        await self._round_trip("EXISTS")
+        return sum(self._read(self._add_prefix(key)) is not None for key in keys)
+
+    async def expire(self, key: str, seconds: int) -> bool:
+        await self._round_trip("EXPIRE")
+        key = self._add_prefix(key)
+
+        if self._read(key) is None:
+            return False
+
+        self.expires[key] = time.time() + seconds
+        return True
+
+    async def hset(self, key: str, mapping: dict) -> int:
+        await self._round_trip("HSET")
+        data = self.data.setdefault(self._add_prefix(key), {})
+        added = sum(field not in data for field in mapping)
+
+        data.update({field: str(value) for field, value in mapping.items()})
+        return added
+
+    async def hgetall(self, key: str) -> dict:
+        await self._round_trip("HGETALL")
+        return dict(self._read(self._add_prefix(key)) or {})
+
+    async def zadd(self, key: str, mapping: dict, nx: bool = False) -> int:
+        await self._round_trip("ZADD")
+        zset = self.data.setdefault(self._add_prefix(key), {})
+        added = 0
+
+        for member, score in mapping.items():
+            if nx and member in zset:
+                continue
+
+            added += member not in zset
+            zset[member] = float(score)
+
+        return added
+
+    async def zrem(self, key: str, *members: str) -> int:
+        await self._round_trip("ZREM")
+        zset = self._read(self._add_prefix(key)) or {}
+
+        return sum(zset.pop(member, None) is not None for member in members)
+
+    async def zrangebyscore(self, name: str, min, max, start: int | None = None, num: int | None = None) -> list[str]:
+        await self._round_trip("ZRANGEBYSCORE")
+        zset = self._read(name) or {}
+
+        low = float(min)
+        high = float(max)
+
+        members = sorted((score, member) for member, score in zset.items() if low <= score <= high)
+        members = [member for _, member in members]
+
+        if start is not None:
+            members = members[start:start + num]
+
+        return members
+
+    async def scan_iter(self, match: str = "*", count: int | None = None):
+        for key in list(self.data):
+            if self._read(key) is not None and fnmatch.fnmatchcase(key, match):
+                yield key
+
+
+class FakePipeline:
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.queued = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.queued = []
+
+    def __getattr__(self, name: str):
+        def queue(*args, **kwargs):
+            self.queued.append((name, args, kwargs))
+            return self
+
+        return queue
+
+    async def execute(self) -> list:
+        await self.redis._round_trip("PIPELINE")
+        queued, self.queued = self.queued, []
+
+        commands = self.redis.commands
+        self.redis.commands = []
+
+        try:
+            return [await getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in queued]
+        finally:
+            self.redis.commands = commands
@@ -0,0 +1,97 @@
+from urllib.parse import parse_qs
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from tests.stand_in import StandInServer
+
+APPLICATION_TOKEN = "application-token"
+
+
+class MicrosoftStandIn(StandInServer):
+    """
+    Local server answering the login (token endpoint) and Graph calls the app makes.
+
+    Tests fill `users` and `changes`, then read back `token_requests` and `graph_requests`.
+    """
+
+    def reset(self):
+        # Returned by a full /users/delta, `page_size` users per page
+        self.users: list[dict] = []
+        self.page_size = 2
+        # Returned for the delta token `delta_token`, other delta tokens have expired
+        self.changes: list[dict] = []
+        self.delta_token = "delta-1"
+        self.expired_delta_tokens: set[str] = set()
+
+        # Refresh tokens the token endpoint rejects
+        self.revoked_refresh_tokens: set[str] = set()
+        self.issued = 0
+
+        # Answered by /me for any user token
+        self.me: dict = {}
+
+        self.token_requests: list[dict] = []
+        self.graph_requests: list[str] = []
+
+    def get_delta_link(self, delta_token: str) -> str:
+        return f"{self.url}/graph/v1.0/users/delta?$deltatoken={delta_token}"
+
+    def create_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.post("/login/{tenant}/oauth2/v2.0/token")
+        async def token(tenant: str, request: Request):
+            form = {key: values[0] for key, values in parse_qs((await request.body()).decode()).items()}
+            self.token_requests.append(form)
+
+            if form.get("grant_type") == "client_credentials":
+                return {"access_token": APPLICATION_TOKEN, "token_type": "Bearer", "expires_in": 3600}
+
+            if form.get("grant_type") != "refresh_token" or form.get("refresh_token") in self.revoked_refresh_tokens:
+                return JSONResponse({"error": "invalid_grant"}, status_code=400)
+
+            self.issued += 1
+
+            return {
+                "access_token": f"access-{self.issued}",
+                "refresh_token": f"refresh-{self.issued}",
+                "token_type": "Bearer",
+                "expires_in": 3600,
+            }
+
+        @app.get("/graph/v1.0/me")
+        async def me(request: Request):
+            self.graph_requests.append(str(request.url))
+
+            if not request.headers.get("Authorization", "").startswith("Bearer access-"):
+                return JSONResponse({"error": {"code": "InvalidAuthenticationToken"}}, status_code=401)
+
+            return self.me
+
+        @app.get("/graph/v1.0/users/delta")
+        async def users_delta(request: Request):
+            self.graph_requests.append(str(request.url))
+
+            if request.headers.get("Authorization") != f"Bearer {APPLICATION_TOKEN}":
+                return JSONResponse({"error": {"code": "InvalidAuthenticationToken"}}, status_code=401)
+
+            delta_token = request.query_params.get("$deltatoken")
+
+            if delta_token is not None:
+                if delta_token in self.expired_delta_tokens or delta_token != self.delta_token:
+                    return JSONResponse({"error": {"code": "syncStateNotFound"}}, status_code=410)
+
+                return {"value": self.changes, "@odata.deltaLink": self.get_delta_link(self.delta_token)}
+
+            skip = int(request.query_params.get("$skiptoken", 0))
+            page = {"value": self.users[skip:skip + self.page_size]}
+
+            if skip + self.page_size < len(self.users):
+                page["@odata.nextLink"] = f"{self.url}/graph/v1.0/users/delta?$skiptoken={skip + self.page_size}"
+            else:
+                page["@odata.deltaLink"] = self.get_delta_link(self.delta_token)
+
+            return page
+
+        return app
@@ -0,0 +1,239 @@
+import hashlib
+import hmac
+import re
+from urllib.parse import parse_qsl, quote, unquote
+from xml.etree import ElementTree
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+from tests.stand_in import StandInServer
+
+ACCESS_KEY = "test-access-key"
+SECRET_KEY = "test-secret-key"
+REGION = "us-east-1"
+
+AUTHORIZATION = re.compile(
+    r"^AWS4-HMAC-SHA256 Credential=(?P<credential>[^,]+), SignedHeaders=(?P<signed_headers>[^,]+), Signature=(?P<signature>[0-9a-f]{64})$"
+)
+NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+def sign(string_to_sign: str, scope: str) -> str:
+    date, region, service, terminator = scope.split("/")
+    key = f"AWS4{SECRET_KEY}".encode()
+
+    for part in (date, region, service, terminator):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+
+    return hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+
+def canonical_query(pairs: list[tuple[str, str]]) -> str:
+    return "&".join(f"{quote(key, safe='')}={quote(value, safe='')}" for key, value in sorted(pairs))
+
+
+def xml_response(root: ElementTree.Element, status_code: int = 200) -> Response:
+    return Response(ElementTree.tostring(root, xml_declaration=True, encoding="utf-8"), status_code, media_type="application/xml")
+
+
+def add(parent: ElementTree.Element, tag: str, text: str | None = None) -> ElementTree.Element:
+    element = ElementTree.SubElement(parent, tag)
+    element.text = text
+    return element
+
+
+class S3StandIn(StandInServer):
+    """
+    Path-style S3 API for one bucket: objects, multipart uploads and ListObjectsV2.
+
+    Every request has its AWS Signature Version 4 checked independently of images.storage,
+    header signatures as well as presigned URLs.
+    """
+
+    bucket = "probook"
+
+    def reset(self):
+        self.bucket_exists = False
+        self.objects: dict[str, tuple[bytes, str]] = {}
+        self.uploads: dict[str, dict[int, bytes]] = {}
+        self.upload_count = 0
+        self.aborted: list[str] = []
+
+        # Part number answered with an error, and whether aborting an upload fails too
+        self.fail_part: int | None = None
+        self.fail_abort = False
+
+        self.requests: list[tuple[str, str, dict]] = []
+
+    def check_signature(self, request: Request, body: bytes) -> bool:
+        path = quote(unquote(request.scope["raw_path"].decode()), safe="/")
+        pairs = parse_qsl(request.scope["query_string"].decode(), keep_blank_values=True)
+        query = dict(pairs)
+
+        if "X-Amz-Signature" in query:
+            signature = query["X-Amz-Signature"]
+            scope = query["X-Amz-Credential"].split("/", 1)[1]
+            amz_date = query["X-Amz-Date"]
+            signed_headers = query["X-Amz-SignedHeaders"]
+            payload_hash = "UNSIGNED-PAYLOAD"
+            pairs = [(key, value) for key, value in pairs if key != "X-Amz-Signature"]
+
+            if query["X-Amz-Credential"].split("/", 1)[0] != ACCESS_KEY:
+                return False
+        else:
+            match = AUTHORIZATION.match(request.headers.get("authorization", ""))
+
+            if match is None:
+                return False
+
+            access_key, scope = match["credential"].split("/", 1)
+            signature = match["signature"]
+            amz_date = request.headers["x-amz-date"]
+            signed_headers = match["signed_headers"]
+            payload_hash = request.headers["x-amz-content-sha256"]
+
+            if access_key != ACCESS_KEY or payload_hash != hashlib.sha256(body).hexdigest():
+                return False
+
+        if not scope.startswith(amz_date[:8]) or scope.split("/")[1] != REGION:
+            return False
+
+        headers = "".join(
+            f"{name}:{' '.join(request.headers[name].split())}\n" for name in signed_headers.split(";")
+        )
+        canonical_request = "\n".join([
+            request.method, path, canonical_query(pairs), headers, signed_headers, payload_hash
+        ])
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()
+        ])
+
+        return hmac.compare_digest(sign(string_to_sign, scope), signature)
+
+    def create_app(self) -> Starlette:
+        async def handle(request: Request) -> Response:
+            body = await request.body()
+            query = dict(request.query_params)
+            self.requests.append((request.method, request.path_params["path"], query))
+
+            if not self.check_signature(request, body):
+                return Response(b"SignatureDoesNotMatch", 403)
+
+            bucket, _, key = unquote(request.path_params["path"]).partition("/")
+
+            if bucket != self.bucket:
+                return Response(status_code=404)
+
+            if not key:
+                return self.handle_bucket(request, query)
+
+            return self.handle_object(request, key, query, body)
+
+        methods = ["GET", "HEAD", "PUT", "POST", "DELETE"]
+        return Starlette(routes=[Route("/{path:path}", handle, methods=methods)])
+
+    def handle_bucket(self, request: Request, query: dict) -> Response:
+        if request.method == "HEAD":
+            return Response(status_code=200 if self.bucket_exists else 404)
+
+        if request.method == "PUT":
+            self.bucket_exists = True
+            return Response()
+
+        if request.method == "GET" and query.get("list-type") == "2":
+            return self.list_objects(int(query.get("max-keys", 1000)), query.get("continuation-token"))
+
+        return Response(status_code=400)
+
+    def list_objects(self, max_keys: int, continuation_token: str | None) -> Response:
+        keys = sorted(self.objects)
+        start = int(continuation_token or 0)
+        page = keys[start:start + max_keys]
+
+        root = ElementTree.Element("ListBucketResult", xmlns=NAMESPACE)
+        add(root, "Name", self.bucket)
+        add(root, "KeyCount", str(len(page)))
+        add(root, "IsTruncated", "true" if start + max_keys < len(keys) else "false")
+
+        if start + max_keys < len(keys):
+            add(root, "NextContinuationToken", str(start + max_keys))
+
+        for key in page:
+            contents = add(root, "Contents")
+            add(contents, "Key", key)
+            add(contents, "Size", str(len(self.objects[key][0])))
+            add(contents, "LastModified", "2026-01-02T03:04:05.000Z")
+
+        return xml_response(root)
+
+    def handle_object(self, request: Request, key: str, query: dict, body: bytes) -> Response:
+        if request.method == "POST" and "uploads" in query:
+            self.upload_count += 1
+            upload_id = f"upload-{self.upload_count}"
+            self.uploads[upload_id] = {}
+
+            root = ElementTree.Element("InitiateMultipartUploadResult", xmlns=NAMESPACE)
+            add(root, "Key", key)
+            add(root, "UploadId", upload_id)
+            return xml_response(root)
+
+        if "uploadId" in query:
+            return self.handle_upload(request, key, query, body)
+
+        if request.method == "PUT":
+            self.objects[key] = (body, request.headers.get("content-type", ""))
+            return Response(headers={"etag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+        if request.method in ("GET", "HEAD"):
+            if key not in self.objects:
+                return Response(status_code=404)
+
+            content, content_type = self.objects[key]
+            return Response(content if request.method == "GET" else b"", media_type=content_type)
+
+        if request.method == "DELETE":
+            self.objects.pop(key, None)
+            return Response(status_code=204)
+
+        return Response(status_code=400)
+
+    def handle_upload(self, request: Request, key: str, query: dict, body: bytes) -> Response:
+        upload_id = query["uploadId"]
+
+        if upload_id not in self.uploads:
+            return Response(b"NoSuchUpload", 404)
+
+        if request.method == "PUT":
+            number = int(query["partNumber"])
+
+            if number == self.fail_part:
+                return Response(b"InternalError", 500)
+
+            self.uploads[upload_id][number] = body
+            return Response(headers={"etag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+        if request.method == "DELETE":
+            if self.fail_abort:
+                return Response(b"InternalError", 500)
+
+            del self.uploads[upload_id]
+            self.aborted.append(upload_id)
+            return Response(status_code=204)
+
+        if request.method == "POST":
+            parts = self.uploads.pop(upload_id)
+            completed = ElementTree.fromstring(body)
+
+            numbers = [int(part.findtext("PartNumber")) for part in completed.iter("Part")]
+            etags = [part.findtext("ETag") for part in completed.iter("Part")]
+
+            if numbers != sorted(parts) or etags != [f'"{hashlib.md5(parts[n]).hexdigest()}"' for n in numbers]:
+                return Response(b"InvalidPart", 400)
+
+            self.objects[key] = (b"".join(parts[number] for number in numbers), "")
+            return xml_response(ElementTree.Element("CompleteMultipartUploadResult", xmlns=NAMESPACE))
+
+        return Response(status_code=400)
@@ -0,0 +1,41 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import uvicorn
+
+
+class StandInServer:
+    """
+    Local uvicorn server in a background thread that replaces an external service in tests.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.app = self.create_app()
+        self.server = None
+        self.reset()
+
+    def create_app(self):
+        raise NotImplementedError
+
+    def reset(self):
+        pass
+
+    def start(self):
+        address = urlsplit(self.url)
+
+        self.server = uvicorn.Server(uvicorn.Config(
+            self.app, host=address.hostname, port=address.port, log_level="warning", lifespan="off"
+        ))
+        threading.Thread(target=self.server.run, daemon=True).start()
+
+        deadline = time.monotonic() + 10
+        while not self.server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{type(self).__name__} did not start")
+
+            time.sleep(0.01)
+
+    def stop(self):
+        self.server.should_exit = True
@@ -0,0 +1,104 @@
+import asyncio
+from types import SimpleNamespace
+from uuid import uuid4
+
+from redis.exceptions import ConnectionError
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from sqlalchemy.util import greenlet_spawn
+
+from action_history import add_action_to_history, HistoryActions
+from action_history import action_history
+from action_history.action_history import ACTION_HISTORY_BUFFER
+from database import json_dumps
+from schemas import ActionHistoryCreate
+
+
+def test_detail_keeps_hex_uuids():
+    session = SimpleNamespace(sync_session=SimpleNamespace(info={}))
+    user_uuid = uuid4()
+    member_uuid = uuid4()
+
+    asyncio.run(add_action_to_history(
+        ActionHistoryCreate(
+            action=HistoryActions.update.value,
+            subject_uuid=user_uuid,
+            object_table="event",
+            object_id=1,
+            detail={"creator": user_uuid, "members": {member_uuid}, "user_uuid": str(user_uuid)}
+        ),
+        session
+    ))
+
+    (payload,) = session.sync_session.info[ACTION_HISTORY_BUFFER]
+
+    # Same document the rows written before orjson hold, so `detail @>` filters keep matching
+    assert payload["detail"] == {"creator": user_uuid.hex, "members": [member_uuid.hex], "user_uuid": str(user_uuid)}
+    assert payload["subject_uuid"] == user_uuid
+    assert json_dumps(payload["detail"]).count(user_uuid.hex) == 1
+
+
+def queue_action(session, object_id: int):
+    asyncio.run(add_action_to_history(
+        ActionHistoryCreate(
+            action=HistoryActions.create.value,
+            subject_uuid=uuid4(),
+            object_table="event",
+            object_id=object_id,
+            detail={}
+        ),
+        SimpleNamespace(sync_session=session)
+    ))
+
+
+def get_buffered_ids(session) -> list[str]:
+    return [entry["object_id"] for entry in session.info.get(ACTION_HISTORY_BUFFER, [])]
+
+
+def test_savepoint_rollback_keeps_outer_entries():
+    with Session(create_engine("sqlite://")) as session:
+        session.connection()
+        queue_action(session, 1)
+
+        savepoint = session.begin_nested()
+        queue_action(session, 2)
+        savepoint.rollback()
+
+        assert get_buffered_ids(session) == ["1"]
+
+        with session.begin_nested():
+            queue_action(session, 3)
+
+        assert get_buffered_ids(session) == ["1", "3"]
+
+        session.rollback()
+
+        assert get_buffered_ids(session) == []
+
+
+def test_stream_outage_inserts_entries_directly(monkeypatch):
+    async def push_actions_to_stream(entries: list[dict]):
+        raise ConnectionError("Redis is down")
+
+    monkeypatch.setattr(action_history, "ACTION_HISTORY_MODE", "stream")
+    monkeypatch.setattr(action_history, "push_actions_to_stream", push_actions_to_stream)
+
+    engine = create_engine("sqlite://")
+
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE action_history (id INTEGER PRIMARY KEY, action, date, subject_uuid, object_table, object_id, detail)"
+        ))
+
+    with Session(engine) as session:
+        session.connection()
+        queue_action(session, 1)
+        queue_action(session, 2)
+
+        # await_only in the commit hooks needs the greenlet AsyncSession runs them in
+        asyncio.run(greenlet_spawn(session.commit))
+
+    with engine.connect() as connection:
+        rows = connection.execute(text("SELECT object_id FROM action_history ORDER BY id")).scalars().all()
+
+    assert rows == ["1", "2"]
@@ -0,0 +1,62 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+
+from auth import auth, session_store, token_refresh
+from auth.session_store import SESSION_PREFIX, is_session_token
+from schemas import UserRead
+from tests.fakes import FakeRedis
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = FakeRedis()
+
+    for module in (session_store, token_refresh):
+        monkeypatch.setattr(module, "redis_db", redis)
+
+    return redis
+
+
+@pytest.fixture
+def user(monkeypatch) -> UserRead:
+    user = UserRead(uuid=uuid4(), is_superuser=False, name="Ann Example", group=None)
+
+    async def get_user_by_uuid(uuid, session):
+        return user if str(uuid) == str(user.uuid) else None
+
+    monkeypatch.setattr(auth, "get_user_by_uuid", get_user_by_uuid)
+    return user
+
+
+def authenticate(token: str):
+    request = SimpleNamespace(state=SimpleNamespace())
+    return asyncio.run(auth.get_current_user(request=request, token=token, session=None, repeat=True))
+
+
+def test_expired_jwt_gets_its_session_id_in_opaque_mode(microsoft, redis, user, monkeypatch):
+    monkeypatch.setattr(auth, "SESSION_MODE", "opaque")
+    microsoft.me = {"id": str(user.uuid), "displayName": user.name}
+
+    expired = auth.create_access_token(
+        user_uuid=str(user.uuid),
+        microsoft_access_token="access-0",
+        microsoft_refresh_token="refresh-0",
+        expires_at=int(time.time()) - 60
+    )
+
+    session_id = authenticate(expired).new_token
+
+    assert session_id is not None and is_session_token(session_id)
+    assert f"{SESSION_PREFIX}{session_id}" in redis.dump()
+
+    # The client switches to the session id, nothing is refreshed again
+    token_requests = len(microsoft.token_requests)
+    refreshed = authenticate(session_id)
+
+    assert refreshed.new_token is None
+    assert refreshed.microsoft_access_token == "access-1"
+    assert len(microsoft.token_requests) == token_requests
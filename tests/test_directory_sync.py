@@ -0,0 +1,143 @@
+import asyncio
+import sys
+from uuid import uuid4
+
+import pytest
+
+import services  # noqa: F401
+from auth import workers_cache
+from auth.workers_cache import WORKERS_CACHE_KEY
+from database import decode_dict
+from tests.fakes import FakeRedis
+
+directory_sync = sys.modules["services.directory_sync"]
+
+
+class UserTableSession:
+    """
+    Stands in for AsyncSession on the user table, records the batched UPDATEs.
+    """
+
+    def __init__(self, names: dict[str, str]):
+        self.names = names
+        self.updates: list[list[dict]] = []
+        self.selects = 0
+
+    def __call__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def execute(self, stmt, params=None):
+        if params is not None:
+            self.updates.append(params)
+
+            for row in params:
+                self.names[row["b_uuid"]] = row["b_name"]
+
+            return None
+
+        self.selects += 1
+        uuids = stmt.whereclause.right.value
+        rows = [(uuid, self.names[uuid]) for uuid in uuids if uuid in self.names]
+
+        return type("Result", (), {"all": lambda _: rows})()
+
+    async def commit(self):
+        pass
+
+
+def graph_user(uuid: str, name: str) -> dict:
+    return {"id": uuid, "displayName": name, "mail": f"{name.split()[0].lower()}@example.com"}
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = FakeRedis()
+
+    for module in (directory_sync, workers_cache):
+        monkeypatch.setattr(module, "redis_db", redis)
+
+    return redis
+
+
+def use_users(monkeypatch, names: dict[str, str]) -> UserTableSession:
+    session = UserTableSession(names)
+    monkeypatch.setattr(directory_sync, "async_session_maker", session)
+    return session
+
+
+def test_full_sync_renames_in_one_batch_per_page(microsoft, redis, monkeypatch):
+    renamed, unchanged, second_renamed = (str(uuid4()) for _ in range(3))
+    session = use_users(monkeypatch, {renamed: "Old Name", unchanged: "Same Name", second_renamed: "Old Too"})
+
+    microsoft.users = [
+        graph_user(renamed, "New Name"),
+        graph_user(unchanged, "Same Name"),
+        # Never signed in, stays out of the user table and the cache
+        graph_user(str(uuid4()), "Stranger Person"),
+        graph_user(second_renamed, "New Too"),
+    ]
+
+    asyncio.run(redis.set(WORKERS_CACHE_KEY, "[]"))
+    asyncio.run(directory_sync.sync_directory())
+
+    # Two pages of two users, one SELECT and at most one UPDATE per page
+    assert len(microsoft.graph_requests) == 2
+    assert session.selects == 2
+    assert session.updates == [
+        [{"b_uuid": renamed, "b_name": "New Name"}],
+        [{"b_uuid": second_renamed, "b_name": "New Too"}],
+    ]
+    assert session.names[unchanged] == "Same Name"
+
+    cached = redis.dump()
+    assert set(key for key in cached if key.startswith("info:")) == {
+        f"info:{uuid}" for uuid in (renamed, unchanged, second_renamed)
+    } | {
+        directory_sync.get_microsoft_info_cache_key(uuid) for uuid in (renamed, unchanged, second_renamed)
+    }
+    assert decode_dict(cached[f"info:{renamed}"])["displayName"] == "New Name"
+    assert cached[directory_sync.DELTA_LINK_KEY] == microsoft.get_delta_link("delta-1")
+    assert WORKERS_CACHE_KEY not in cached
+
+
+def test_delta_sync_applies_only_changes(microsoft, redis, monkeypatch):
+    uuid = str(uuid4())
+    session = use_users(monkeypatch, {uuid: "Old Name"})
+
+    asyncio.run(redis.set(directory_sync.DELTA_LINK_KEY, microsoft.get_delta_link("delta-1")))
+    asyncio.run(redis.set(f"info:{uuid}", '{"displayName": "Old Name", "jobTitle": "Engineer"}'))
+
+    microsoft.changes = [graph_user(uuid, "New Name"), {"id": str(uuid4()), "@removed": {"reason": "deleted"}}]
+    microsoft.delta_token = "delta-1"
+
+    asyncio.run(directory_sync.sync_directory())
+
+    assert microsoft.graph_requests == [microsoft.get_delta_link("delta-1")]
+    assert session.updates == [[{"b_uuid": uuid, "b_name": "New Name"}]]
+
+    # Fields Graph did not send are kept
+    info = decode_dict(redis.dump()[f"info:{uuid}"])
+    assert info["displayName"] == "New Name"
+    assert info["jobTitle"] == "Engineer"
+
+
+def test_expired_delta_link_falls_back_to_full_sync(microsoft, redis, monkeypatch):
+    uuid = str(uuid4())
+    session = use_users(monkeypatch, {uuid: "Old Name"})
+
+    asyncio.run(redis.set(directory_sync.DELTA_LINK_KEY, microsoft.get_delta_link("expired")))
+
+    microsoft.users = [graph_user(uuid, "New Name")]
+    microsoft.delta_token = "delta-2"
+
+    asyncio.run(directory_sync.sync_directory())
+
+    assert len(microsoft.graph_requests) == 2
+    assert session.updates == [[{"b_uuid": uuid, "b_name": "New Name"}]]
+    assert redis.dump()[directory_sync.DELTA_LINK_KEY] == microsoft.get_delta_link("delta-2")
@@ -0,0 +1,83 @@
+import asyncio
+import sys
+import time
+
+import jwt
+import pytest
+
+import services  # noqa: F401
+from auth import session_store, token_refresh
+from auth.auth import SECRET, ALGORITHM
+from auth.token_refresh import SCHEDULE_KEY, SESSION_PREFIX, get_session_id, get_refreshed_token, schedule_token_refresh
+from tests.fakes import FakeRedis
+
+token_refresher = sys.modules["services.token_refresher"]
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = FakeRedis()
+
+    for module in (token_refresher, token_refresh, session_store):
+        monkeypatch.setattr(module, "redis_db", redis)
+
+    return redis
+
+
+def get_schedule(redis: FakeRedis) -> dict:
+    return redis.dump().get(SCHEDULE_KEY, {})
+
+
+def get_refresh_requests(microsoft) -> list[str]:
+    return [request["refresh_token"] for request in microsoft.token_requests if request["grant_type"] == "refresh_token"]
+
+
+def test_due_sessions_are_refreshed_once(microsoft, redis):
+    now = int(time.time())
+
+    asyncio.run(schedule_token_refresh("user-due", "refresh-due", now + 60))
+    asyncio.run(schedule_token_refresh("user-later", "refresh-later", now + 3600))
+
+    async def run_workers():
+        # Both workers see the same due session, only one claims it
+        await asyncio.gather(token_refresher.refresh_due_sessions(), token_refresher.refresh_due_sessions())
+
+    asyncio.run(run_workers())
+
+    assert get_refresh_requests(microsoft) == ["refresh-due"]
+    assert list(get_schedule(redis)) == [get_session_id("refresh-later")]
+    assert f"{SESSION_PREFIX}{get_session_id('refresh-due')}" not in redis.dump()
+
+    token = asyncio.run(get_refreshed_token("refresh-due"))
+    payload = jwt.decode(token, SECRET, algorithms=[ALGORITHM])
+
+    assert payload["sub"] == "user-due"
+    assert payload["ma_token"] == "access-1"
+    assert payload["mr_token"] == "refresh-1"
+
+
+def test_opaque_session_is_refreshed_in_place(microsoft, redis):
+    session_id = asyncio.run(session_store.create_session("user", "access-0", "refresh-0", int(time.time()) + 60))
+    asyncio.run(schedule_token_refresh("user", "refresh-0", int(time.time()) + 60, session_id))
+
+    asyncio.run(token_refresher.refresh_due_sessions())
+
+    session = asyncio.run(session_store.get_session(session_id))
+    assert session["ma_token"] == "access-1"
+    assert session["mr_token"] == "refresh-1"
+
+    # Scheduled again under the new refresh token, an hour from now
+    schedule = get_schedule(redis)
+    assert list(schedule) == [get_session_id("refresh-1")]
+    assert schedule[get_session_id("refresh-1")] > time.time() + token_refresh.TOKEN_REFRESH_LEAD
+
+
+def test_rejected_refresh_drops_the_session(microsoft, redis):
+    microsoft.revoked_refresh_tokens.add("refresh-revoked")
+    asyncio.run(schedule_token_refresh("user", "refresh-revoked", int(time.time())))
+
+    asyncio.run(token_refresher.refresh_due_sessions())
+
+    assert get_refresh_requests(microsoft) == ["refresh-revoked"]
+    assert asyncio.run(get_refreshed_token("refresh-revoked")) is None
+    assert redis.dump() == {}
@@ -0,0 +1,87 @@
+import asyncio
+from types import SimpleNamespace
+from uuid import uuid4
+
+from auth.auth import redis_db
+from routers.auth import get_users
+
+
+class CountingSession:
+    """
+    Stands in for AsyncSession, answers the listing, default group and count queries.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.round_trips = 0
+
+    async def execute(self, stmt):
+        self.round_trips += 1
+
+        if "group_name" in str(stmt):
+            return SimpleNamespace(fetchall=lambda: self.rows)
+
+        default_group = SimpleNamespace(id=1, name="default", permissions=[], is_default=True)
+        return SimpleNamespace(first=lambda: default_group)
+
+    async def scalar(self, stmt):
+        self.round_trips += 1
+        return len(self.rows)
+
+
+def make_rows(count: int) -> list:
+    rows = []
+
+    for i in range(count):
+        # Every other user has no group and falls back to the default one
+        has_group = i % 2 == 0
+
+        rows.append(SimpleNamespace(
+            uuid=uuid4(),
+            name=f"User {i}",
+            is_superuser=False,
+            group_id=2 if has_group else None,
+            group_db_id=2 if has_group else None,
+            group_name="staff" if has_group else None,
+            group_permissions=[] if has_group else None,
+            group_is_default=False if has_group else None,
+        ))
+
+    return rows
+
+
+def list_users(monkeypatch, count: int):
+    redis_calls = []
+
+    async def mget(keys, *args):
+        redis_calls.append(keys)
+        return [None] * len(keys)
+
+    monkeypatch.setattr(redis_db, "mget", mget)
+
+    session = CountingSession(make_rows(count))
+    user = SimpleNamespace(new_token=None)
+
+    response = asyncio.run(get_users(
+        user=user, session=session, display_name=None, is_superuser=None, group_id=None, limit=60, page=1
+    ))
+
+    return response, session.round_trips, redis_calls
+
+
+def test_get_users_round_trips_do_not_grow_with_page(monkeypatch):
+    _, small_db, small_redis = list_users(monkeypatch, 2)
+    response, db_round_trips, redis_calls = list_users(monkeypatch, 60)
+
+    assert len(response.result) == 60
+    # Listing, default group and count
+    assert db_round_trips == small_db == 3
+    assert len(redis_calls) == len(small_redis) == 1
+    assert len(redis_calls[0]) == 2 * 60
+
+
+def test_get_users_keeps_groups(monkeypatch):
+    response, _, _ = list_users(monkeypatch, 4)
+
+    assert [user.group.name for user in response.result] == ["staff", "default", "staff", "default"]
+    assert all(user.microsoft is None and user.image_path is None for user in response.result)